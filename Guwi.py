@@ -2,9 +2,18 @@ import tkinter as tk
 from tkinter import filedialog, scrolledtext, messagebox
 import subprocess
 import threading
+import queue
+import codecs
 import os
 import sys
 
+# How often (ms) the GUI drains buffered subprocess output into the log
+LOG_POLL_INTERVAL = 50
+# Upper bound on output chunks inserted per poll so a burst can't stall the Tk thread
+LOG_DRAIN_MAX = 16
+# Size of each raw read from the subprocess pipe
+READ_CHUNK_SIZE = 64 * 1024
+
 class TranslationApp:
     def __init__(self, root):
         self.root = root
@@ -55,6 +64,10 @@ class TranslationApp:
         self.log_area = scrolledtext.ScrolledText(output_frame, state='disabled', height=15)
         self.log_area.pack(fill="both", expand=True)
 
+        # Worker thread pushes output chunks here; the Tk thread drains them in batches
+        self.log_queue = queue.SimpleQueue()
+        self.root.after(LOG_POLL_INTERVAL, self.poll_log_queue)
+
     def browse_directory(self):
         directory = filedialog.askdirectory()
         if directory:
@@ -67,6 +80,23 @@ class TranslationApp:
         self.log_area.see(tk.END)
         self.log_area.config(state='disabled')
 
+    def flush_log_queue(self, max_chunks=None):
+        """Moves queued output into the log with a single insert. Returns True if output remains."""
+        chunks = []
+        try:
+            while max_chunks is None or len(chunks) < max_chunks:
+                chunks.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if chunks:
+            self.log("".join(chunks))
+        return not self.log_queue.empty()
+
+    def poll_log_queue(self):
+        backlog = self.flush_log_queue(LOG_DRAIN_MAX)
+        # Come straight back if there is still a backlog, otherwise wait for the next tick
+        self.root.after(1 if backlog else LOG_POLL_INTERVAL, self.poll_log_queue)
+
     def start_translation(self):
         directory = self.dir_entry.get()
         if not directory:
@@ -116,27 +146,38 @@ class TranslationApp:
 
     def run_process(self, cmd):
         try:
+            # Read raw bytes and decode whole chunks instead of paying for per-line text I/O.
+            # The child is told to write UTF-8 so the decoder below always matches it.
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
+                bufsize=0,
+                env=dict(os.environ, PYTHONIOENCODING="utf-8"),
                 creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
             )
 
-            for line in process.stdout:
-                self.root.after(0, self.log, line)
+            fd = process.stdout.fileno()
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                data = os.read(fd, READ_CHUNK_SIZE)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    self.log_queue.put(text.replace("\r\n", "\n"))
+                if not data:
+                    break
 
             process.wait()
             
             self.root.after(0, self.on_process_complete, process.returncode)
 
         except Exception as e:
-            self.root.after(0, self.log, f"Error: {str(e)}\n")
+            self.log_queue.put(f"Error: {str(e)}\n")
             self.root.after(0, self.on_process_complete, -1)
 
     def on_process_complete(self, returncode):
+        # Make sure all buffered output lands before the completion message
+        self.flush_log_queue()
         self.start_btn.config(state="normal")
         if returncode == 0:
             self.log("\nProcess completed successfully.\n")
@@ -1,32 +1,52 @@
 import os
+import re
 
 TRANSLATED_DIR = "translated_chapters"
 
+# All completion markers in one case-insensitive pass over the raw UTF-8 bytes
+END_MARKER_RE = re.compile(r"\(end of (?:this )?chapter\)|\(本章完\)".encode("utf-8"), re.IGNORECASE)
+# Markers sit at the end of a chapter, so only this many trailing bytes are read
+TAIL_BYTES = 1024
+
 def check_translations():
     if not os.path.exists(TRANSLATED_DIR):
         print(f"Directory '{TRANSLATED_DIR}' not found.")
         return
 
-    files = sorted([f for f in os.listdir(TRANSLATED_DIR) if f.endswith(".txt")])
+    # scandir entries cache their stat, so empty files can be spotted without opening them
+    entries = sorted((e for e in os.scandir(TRANSLATED_DIR) if e.name.endswith(".txt")), key=lambda e: e.name)
+    files = [e.name for e in entries]
     incomplete_chapters = []
     total_files = len(files)
 
     print(f"Scanning {total_files} files in '{TRANSLATED_DIR}'...\n")
 
-    for filename in files:
-        filepath = os.path.join(TRANSLATED_DIR, filename)
+    for entry in entries:
+        filename = entry.name
+        filepath = entry.path
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            size = entry.stat().st_size
+            if size == 0:
+                print(f"[EMPTY] {filename}")
+                incomplete_chapters.append(filename)
+                continue
+
+            with open(filepath, 'rb') as f:
+                f.seek(max(0, size - TAIL_BYTES))
+                tail = f.read()
                 
-                if not content.strip():
-                    print(f"[EMPTY] {filename}")
-                    incomplete_chapters.append(filename)
-                    continue
+                # A blank tail may still sit after real content, so only a
+                # full read can tell an empty file from a truncated one
+                if not tail.decode('utf-8', 'ignore').strip():
+                    f.seek(0)
+                    tail = f.read()
+                    if not tail.decode('utf-8').strip():
+                        print(f"[EMPTY] {filename}")
+                        incomplete_chapters.append(filename)
+                        continue
                 
                 # Check for markers (case-insensitive)
-                content_lower = content.lower()
-                if "(end of chapter)" not in content_lower and "(end of this chapter)" not in content_lower and "(本章完)" not in content:
+                if not END_MARKER_RE.search(tail):
                     print(f"[INCOMPLETE] {filename}")
                     incomplete_chapters.append(filename)
 
@@ -1,12 +1,24 @@
 import os
+import re
+import html
+import json
 import markdown
 import shutil
+import concurrent.futures
 
 import argparse
 
 DEFAULT_TRANSLATED_DIR = "translated_chapters"
 DEFAULT_OUTPUT_DIR = "docs"
 TEMPLATE_DIR = "templates"
+BUILD_CACHE_FILE = ".build_cache.json"
+# Bump whenever the page template changes so cached pages get re-rendered
+BUILD_CACHE_VERSION = 2
+RENDER_CHUNKSIZE = 16
+# Below this many pages a process pool costs more than it saves: on Windows
+# every worker re-imports the calling translator script, and on Linux it
+# forks a multi-threaded parent
+POOL_MIN_PAGES = 2 * (os.cpu_count() or 1) * RENDER_CHUNKSIZE
 
 # Simple CSS for mobile-friendly reading with Dark Mode support
 CSS = """
@@ -106,8 +118,8 @@ p {
 }
 """
 
-JS_SCRIPT = """
-<script>
+# Theme toggle, written once per site as theme.js so pages can share the cached file
+THEME_JS = """
     const toggleButton = document.getElementById('theme-toggle');
     const currentTheme = localStorage.getItem('theme');
 
@@ -128,15 +140,111 @@ JS_SCRIPT = """
             toggleButton.textContent = '☀️';
         }
     });
-</script>
 """
 
-def generate_site(source_dir=DEFAULT_TRANSLATED_DIR, output_dir=DEFAULT_OUTPUT_DIR):
+JS_SCRIPT = '<script src="theme.js" defer></script>'
+
+# One Markdown converter per process; reset() between documents keeps the built pipeline
+MARKDOWN = markdown.Markdown()
+
+# Blank-line paragraph splitter for --simple mode (plain prose, no Markdown syntax)
+PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+
+def render_paragraphs(text):
+    """
+    Renders plain prose as one <p> per blank-line separated block.
+    """
+    return "\n".join(f"<p>{html.escape(p)}</p>" for p in PARAGRAPH_SPLIT_RE.split(text.strip()) if p)
+
+# Chapter page template, formatted once per page and written around the chapter body
+# so the full page never has to be assembled as one string
+CHAPTER_PAGE_HEAD = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Chapter {chapter_num}</title>
+        <link rel="stylesheet" href="style.css">
+        <link href="https://fonts.googleapis.com/css2?family=Merriweather:wght@300;400;700&display=swap" rel="stylesheet">
+    </head>
+    <body>
+        <button id="theme-toggle" class="theme-toggle">🌙</button>
+        <div class="container">
+            <div class="nav">
+                <a href="index.html">Home</a>
+            </div>
+            """
+
+CHAPTER_PAGE_TAIL = """
+            <div class="nav">
+                <a href="{prev_link}" style="visibility: {prev_visibility}">← Previous</a>
+                <a href="{next_link}" style="visibility: {next_visibility}">Next →</a>
+            </div>
+        </div>
+        {js}
+    </body>
+    </html>
+    """
+
+def render_chapter(args):
+    """
+    Renders a single chapter .txt into its HTML page, in-process or in a pool worker.
+    """
+    chapter_num, source_path, output_path, prev_link, next_link, simple = args
+    
+    with open(source_path, "r", encoding="utf-8") as f:
+        md_content = f.read()
+        
+    if simple:
+        html_content = render_paragraphs(md_content)
+    else:
+        html_content = MARKDOWN.convert(md_content)
+        MARKDOWN.reset()
+    
+    # Pre-encoded bytes skip the TextIOWrapper encode path
+    with open(output_path, "wb") as f:
+        f.write(CHAPTER_PAGE_HEAD.format(chapter_num=chapter_num).encode("utf-8"))
+        f.write(html_content.encode("utf-8"))
+        f.write(CHAPTER_PAGE_TAIL.format(
+            prev_link=prev_link,
+            next_link=next_link,
+            prev_visibility='visible' if prev_link != "#" else 'hidden',
+            next_visibility='visible' if next_link != "#" else 'hidden',
+            js=JS_SCRIPT,
+        ).encode("utf-8"))
+
+def load_build_cache(output_dir):
+    cache_path = os.path.join(output_dir, BUILD_CACHE_FILE)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != BUILD_CACHE_VERSION:
+        return {}
+    return cache
+
+def save_build_cache(cache, output_dir):
+    cache_path = os.path.join(output_dir, BUILD_CACHE_FILE)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+def generate_site(source_dir=DEFAULT_TRANSLATED_DIR, output_dir=DEFAULT_OUTPUT_DIR, simple=False, parallel=None):
+    """
+    Builds the book's static site, re-rendering only changed chapters.
+    parallel=None uses a process pool only for large rebuilds (POOL_MIN_PAGES);
+    True or False forces it on or off.
+    """
     os.makedirs(output_dir, exist_ok=True)
     
     # Write CSS
-    with open(os.path.join(output_dir, "style.css"), "w", encoding="utf-8") as f:
-        f.write(CSS)
+    with open(os.path.join(output_dir, "style.css"), "wb") as f:
+        f.write(CSS.encode("utf-8"))
+    with open(os.path.join(output_dir, "theme.js"), "wb") as f:
+        f.write(THEME_JS.encode("utf-8"))
 
     if not os.path.exists(source_dir):
         print(f"Source directory '{source_dir}' not found.")
@@ -144,8 +252,21 @@ def generate_site(source_dir=DEFAULT_TRANSLATED_DIR, output_dir=DEFAULT_OUTPUT_D
 
     chapters = sorted([f for f in os.listdir(source_dir) if f.endswith(".txt")])
     
-    # Generate Index
-    index_html = f"""
+    # Precompute every page name and path once; the loop below only indexes into these
+    names = [f"chapter_{i+1:03}.html" for i in range(len(chapters))]
+    prev_links = ["#"] + names[:-1]
+    next_links = names[1:] + ["#"]
+    source_paths = [os.path.join(source_dir, c) for c in chapters]
+    output_paths = [os.path.join(output_dir, n) for n in names]
+    
+    cache = load_build_cache(output_dir)
+    cached_files = cache.get("files", {})
+    existing_outputs = set(os.listdir(output_dir))
+    
+    # One pass over the chapters builds the index entries and the render queue,
+    # skipping pages whose source and position are unchanged
+    total = len(chapters)
+    parts = [f"""
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -159,77 +280,58 @@ def generate_site(source_dir=DEFAULT_TRANSLATED_DIR, output_dir=DEFAULT_OUTPUT_D
         <div class="container">
             <h1>Translated Chapters</h1>
             <ul class="chapter-list">
-    """
-    
+    """]
+    render_args = []
+    new_files = {}
     for i, chapter_file in enumerate(chapters):
-        chapter_num = i + 1
-        link = f"chapter_{chapter_num:03}.html"
-        index_html += f'<li><a href="{link}">Chapter {chapter_num}</a></li>\n'
+        parts.append(f'<li><a href="{names[i]}">Chapter {i + 1}</a></li>\n')
+        
+        st = os.stat(source_paths[i])
+        # Position matters too: it decides the output name and the prev/next links
+        key = [st.st_mtime_ns, st.st_size, i, i < total - 1, simple]
+        new_files[chapter_file] = key
+        if cached_files.get(chapter_file) == key and names[i] in existing_outputs:
+            continue
+        render_args.append((i + 1, source_paths[i], output_paths[i], prev_links[i], next_links[i], simple))
         
-    index_html += f"""
+    parts.append(f"""
             </ul>
         </div>
         {JS_SCRIPT}
     </body>
     </html>
-    """
+    """)
     
-    with open(os.path.join(output_dir, "index.html"), "w", encoding="utf-8") as f:
-        f.write(index_html)
-        
-    # Generate Chapter Pages
-    for i, chapter_file in enumerate(chapters):
-        chapter_num = i + 1
-        prev_link = f"chapter_{chapter_num-1:03}.html" if i > 0 else "#"
-        next_link = f"chapter_{chapter_num+1:03}.html" if i < len(chapters) - 1 else "#"
-        
-        with open(os.path.join(source_dir, chapter_file), "r", encoding="utf-8") as f:
-            md_content = f.read()
-            
-        html_content = markdown.markdown(md_content)
-        
-        page_html = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Chapter {chapter_num}</title>
-            <link rel="stylesheet" href="style.css">
-            <link href="https://fonts.googleapis.com/css2?family=Merriweather:wght@300;400;700&display=swap" rel="stylesheet">
-        </head>
-        <body>
-            <button id="theme-toggle" class="theme-toggle">🌙</button>
-            <div class="container">
-                <div class="nav">
-                    <a href="index.html">Home</a>
-                </div>
-                {html_content}
-                <div class="nav">
-                    <a href="{prev_link}" style="visibility: {'visible' if i > 0 else 'hidden'}">← Previous</a>
-                    <a href="{next_link}" style="visibility: {'visible' if i < len(chapters) - 1 else 'hidden'}">Next →</a>
-                </div>
-            </div>
-            {JS_SCRIPT}
-        </body>
-        </html>
-        """
-        
-        output_filename = f"chapter_{chapter_num:03}.html"
-        with open(os.path.join(output_dir, output_filename), "w", encoding="utf-8") as f:
-            f.write(page_html)
+    # Write Index (only when the chapter list changed)
+    if cache.get("chapters") != chapters or "index.html" not in existing_outputs:
+        with open(os.path.join(output_dir, "index.html"), "wb") as f:
+            f.write("".join(parts).encode("utf-8"))
+    
+    # markdown parsing is CPU-bound, so big rebuilds fan out across processes
+    if parallel is None:
+        parallel = len(render_args) >= POOL_MIN_PAGES
+    if parallel and render_args:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            list(executor.map(render_chapter, render_args, chunksize=RENDER_CHUNKSIZE))
+    else:
+        for render_arg in render_args:
+            render_chapter(render_arg)
+    
+    save_build_cache({"version": BUILD_CACHE_VERSION, "chapters": chapters, "files": new_files}, output_dir)
             
-    print(f"Site generated in '{output_dir}' folder.")
+    print(f"Site generated in '{output_dir}' folder ({len(render_args)}/{total} chapters rebuilt).")
 
 def generate_library_index(library_dir, book_dirs):
     """
     Generates a main index.html in the library_dir linking to all books.
     """
-    # Write CSS to library root as well
-    with open(os.path.join(library_dir, "style.css"), "w", encoding="utf-8") as f:
-        f.write(CSS)
+    # Write CSS and JS to library root as well
+    with open(os.path.join(library_dir, "style.css"), "wb") as f:
+        f.write(CSS.encode("utf-8"))
+    with open(os.path.join(library_dir, "theme.js"), "wb") as f:
+        f.write(THEME_JS.encode("utf-8"))
 
-    index_html = f"""
+    parts = [f"""
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -243,24 +345,25 @@ def generate_library_index(library_dir, book_dirs):
         <div class="container">
             <h1>Library</h1>
             <ul class="chapter-list">
-    """
+    """]
     
     for book_path in book_dirs:
         book_name = os.path.basename(book_path)
         # Assuming standard structure: BookName/docs/index.html
         link = f"{book_name}/docs/index.html"
-        index_html += f'<li><a href="{link}">{book_name}</a></li>\n'
+        parts.append(f'<li><a href="{link}">{book_name}</a></li>\n')
         
-    index_html += f"""
+    parts.append(f"""
             </ul>
         </div>
         {JS_SCRIPT}
     </body>
     </html>
-    """
+    """)
+    index_html = "".join(parts)
     
-    with open(os.path.join(library_dir, "index.html"), "w", encoding="utf-8") as f:
-        f.write(index_html)
+    with open(os.path.join(library_dir, "index.html"), "wb") as f:
+        f.write(index_html.encode("utf-8"))
     
     print(f"Library index generated in '{library_dir}'.")
 
@@ -268,6 +371,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate static site from translated chapters.")
     parser.add_argument("--source", default=DEFAULT_TRANSLATED_DIR, help="Directory containing translated chapters")
     parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="Directory to output the static site")
+    parser.add_argument("--simple", action="store_true", help="Render chapters as plain paragraphs instead of Markdown (much faster)")
     args = parser.parse_args()
 
-    generate_site(args.source, args.output)
+    # Run as a script, the workers have nothing heavy to re-import
+    generate_site(args.source, args.output, simple=args.simple, parallel=True)
@@ -2,6 +2,16 @@ import os
 import shutil
 import sys
 
+def move_path(src, dst, same_device):
+    """
+    Moves src to a dst that does not exist yet. On a single filesystem this is
+    one rename syscall; across devices fall back to shutil's copy + delete.
+    """
+    if same_device:
+        os.rename(src, dst)
+    else:
+        shutil.move(src, dst)
+
 def migrate():
     # Define paths
     current_dir = os.getcwd()
@@ -21,28 +31,34 @@ def migrate():
         print(f"Creating Book directory: {book_dir}")
         os.makedirs(book_dir)
         
+    # Snapshot both directories once instead of stat-ing every path individually
+    # (the source snapshot is taken after book_dir exists, since it may live under it)
+    current_entries = {e.name for e in os.scandir(current_dir)}
+    book_entries = {e.name for e in os.scandir(book_dir)}
+    same_device = os.stat(current_dir).st_dev == os.stat(book_dir).st_dev
+        
     # Move folders
     for folder in folders_to_move:
         src = os.path.join(current_dir, folder)
         dst = os.path.join(book_dir, folder)
         
-        if os.path.exists(src):
+        if folder in current_entries:
             print(f"Moving {folder} to {dst}...")
-            if os.path.exists(dst):
+            if folder in book_entries:
                 print(f"  Destination {dst} already exists. Merging/Overwriting...")
                 # shutil.move fails if dst exists and is a dir, so we need to handle it
-                for item in os.listdir(src):
-                    s = os.path.join(src, item)
-                    d = os.path.join(dst, item)
-                    if os.path.exists(d):
-                        if os.path.isdir(s):
+                dst_entries = {e.name for e in os.scandir(dst)}
+                for entry in list(os.scandir(src)):
+                    d = os.path.join(dst, entry.name)
+                    if entry.name in dst_entries:
+                        if entry.is_dir(follow_symlinks=False):
                             shutil.rmtree(d)
                         else:
                             os.remove(d)
-                    shutil.move(s, d)
+                    move_path(entry.path, d, same_device)
                 os.rmdir(src) # Remove empty source dir
             else:
-                shutil.move(src, dst)
+                move_path(src, dst, same_device)
         else:
             print(f"  Source {folder} not found. Skipping.")
             
@@ -51,12 +67,12 @@ def migrate():
         src = os.path.join(current_dir, filename)
         dst = os.path.join(book_dir, filename)
         
-        if os.path.exists(src):
+        if filename in current_entries:
             print(f"Moving {filename} to {dst}...")
-            if os.path.exists(dst):
+            if filename in book_entries:
                 print(f"  Destination {dst} already exists. Overwriting...")
                 os.remove(dst)
-            shutil.move(src, dst)
+            move_path(src, dst, same_device)
         else:
             print(f"  Source {filename} not found. Skipping.")
 
@@ -1,11 +1,36 @@
 import os
+import concurrent.futures
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
+from lxml import etree
 import re
 
 EPUB_PATH = "raw_chapters/Novel.epub"
 OUTPUT_DIR = "raw_chapters"
+# Sections with less text than this are treated as TOC/cover pages and skipped
+MIN_CHAPTER_LENGTH = 100
+
+def extract_text(content):
+    """
+    Extracts the text of an XHTML document, one paragraph per text node.
+    """
+    parser = etree.HTMLParser(remove_comments=True, huge_tree=True)
+    root = etree.fromstring(content, parser)
+    if root is None:
+        return ""
+    # Stylesheets and scripts are not chapter text (BeautifulSoup's get_text
+    # skipped them too); with_tail=False keeps the text that follows them
+    etree.strip_elements(root, "script", "style", with_tail=False)
+    return "\n\n".join(t.strip() for t in root.itertext() if t.strip())
+
+def save_chapter(args):
+    chapter_num, text = args
+    filename = f"chapter_{chapter_num:03}.txt"
+    filepath = os.path.join(OUTPUT_DIR, filename)
+    
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write(text)
+    return filepath
 
 def process_epub():
     """
@@ -22,30 +47,25 @@ def process_epub():
         print(f"Error reading EPUB: {e}")
         return
     
-    chapter_count = 0
+    # Collect document bodies up front so parsing and writing can run in a thread pool.
+    # Extracted text is never longer than the markup it came from, so documents whose
+    # raw bytes are already under the minimum can be dropped without parsing them.
+    contents = [
+        content
+        for content in (item.get_content() for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
+        if len(content) >= MIN_CHAPTER_LENGTH
+    ]
     
-    # Iterate through items in the book
-    for item in book.get_items():
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            # Get HTML content
-            content = item.get_content()
-            soup = BeautifulSoup(content, 'html.parser')
-            
-            # Extract text
-            text = soup.get_text(separator='\n\n', strip=True)
-            
-            # Basic filter: skip very short sections (likely TOC, cover, or empty)
-            if len(text) < 100:
-                continue
-                
-            chapter_count += 1
-            filename = f"chapter_{chapter_count:03}.txt"
-            filepath = os.path.join(OUTPUT_DIR, filename)
-            
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(text)
-            
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        texts = list(executor.map(extract_text, contents))
+        
+        # Basic filter: skip very short sections (likely TOC, cover, or empty)
+        chapters = [text for text in texts if len(text) >= MIN_CHAPTER_LENGTH]
+        
+        for filepath in executor.map(save_chapter, enumerate(chapters, start=1)):
             print(f"Saved: {filepath}")
+            
+    chapter_count = len(chapters)
 
     print(f"\nDone! Extracted {chapter_count} chapters to {OUTPUT_DIR}")
 
@@ -0,0 +1,37 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from translator_core import RateLimiter
+
+
+def run_with_timeout(func, timeout):
+    """Runs func on a daemon thread; returns True if it finished within timeout."""
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_estimate_above_tpm_limit_is_admitted_when_window_is_empty(self):
+        limiter = RateLimiter(rpm_limit=10, tpm_limit=100)
+        self.assertTrue(run_with_timeout(lambda: limiter.wait_if_needed(500), 2))
+        self.assertEqual(limiter._token_sum, 500)
+
+    def test_estimate_above_tpm_limit_waits_for_a_busy_window(self):
+        limiter = RateLimiter(rpm_limit=10, tpm_limit=100)
+        limiter.wait_if_needed(50)
+        self.assertFalse(run_with_timeout(lambda: limiter.wait_if_needed(500), 0.3))
+
+    def test_estimate_within_limit_is_admitted(self):
+        limiter = RateLimiter(rpm_limit=10, tpm_limit=100)
+        limiter.wait_if_needed(40)
+        self.assertTrue(run_with_timeout(lambda: limiter.wait_if_needed(60), 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,16 @@
 import os
-import json
 import time
 import typing_extensions as typing
 import argparse
-import ctypes
 import threading
 import generate_site
+from translator_core import (
+    RateLimiter, run_in_pool, json_loads, load_glossary, save_glossary,
+    build_glossary_index, filter_glossary, format_glossary, merge_new_terms,
+    split_nonblank_lines, check_hallucination, validate_translation, validate_text,
+    VALIDATION_CACHE_FILE, load_validation_cache, save_validation_cache,
+    numbered_chapters, backoff_delay, prevent_sleep, allow_sleep,
+)
 from dotenv import load_dotenv
 
 # --- NEW: Cerebras Import ---
@@ -15,6 +20,14 @@ except ImportError:
     print("CRITICAL: Cerebras SDK not found. Please run 'pip install cerebras_cloud_sdk'")
     exit(1)
 
+# Optional: tiktoken gives a much closer token count than the length heuristic.
+# get_encoding may need to download the BPE file, so any failure falls back.
+try:
+    import tiktoken
+    TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    TOKEN_ENCODING = None
+
 # Load environment variables
 load_dotenv()
 
@@ -37,210 +50,95 @@ DEFAULT_GLOSSARY_FILE = "glossary.json"
 # Thread synchronization
 glossary_lock = threading.Lock()
 
-# Windows Sleep Prevention
-ES_CONTINUOUS = 0x80000000
-ES_SYSTEM_REQUIRED = 0x00000001
-
-def prevent_sleep():
-    try:
-        ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS | ES_SYSTEM_REQUIRED)
-    except AttributeError:
-        pass
-
-def allow_sleep():
-    try:
-        ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS)
-    except AttributeError:
-        pass
-
-# --- VALIDATION LOGIC ---
-
-def check_hallucination(text):
-    """Checks for repetitive loops."""
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    if len(lines) < 10: return False
-    
-    # Check for immediate repetition
-    for i in range(len(lines) - 5):
-        chunk = lines[i:i+5]
-        if i + 10 <= len(lines):
-            next_chunk = lines[i+5:i+10]
-            if chunk == next_chunk: return True
-    return False
-
-def check_refusal(text):
-    refusal_keywords = [
-        "I cannot translate", "I can't translate", "unable to translate",
-        "AI language model", "content policy", "safety guidelines"
-    ]
-    lower_text = text.lower()
-    return any(k in lower_text for k in refusal_keywords)
-
-def validate_translation(filepath, source_text=None):
-    """
-    Robustly checks if translation is valid and complete.
-    """
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-            if not content.strip():
-                print(f"❌ Empty content: {filepath}")
-                return False
-            
-            if check_refusal(content):
-                print(f"❌ Refusal detected: {filepath}")
-                return False
-
-            if check_hallucination(content):
-                print(f"❌ Hallucination detected: {filepath}")
-                return False
-
-            if source_text:
-                # 1. Length Ratio Check
-                # English is usually longer than CJK. < 0.6 is suspicious.
-                if len(source_text) > 0:
-                    ratio = len(content) / len(source_text)
-                    if ratio < 0.6: 
-                        print(f"❌ Text too short ({ratio:.2f}x). Likely summary.")
-                        return False
-                
-                # 2. Line Count Check (The "Middle Skip" Detector)
-                source_lines = len([x for x in source_text.split('\n') if x.strip()])
-                trans_lines = len([x for x in content.split('\n') if x.strip()])
-                
-                # Allow some consolidation, but < 50% usually means skipped content
-                if source_lines > 20 and trans_lines < (source_lines * 0.5):
-                    print(f"❌ Paragraph mismatch (Source: {source_lines}, Trans: {trans_lines}). Content skipped.")
-                    return False
-
-            # 3. End Marker Check
-            if "<<END_OF_CHAPTER>>" in content:
-                return True
-            
-            print(f"❌ Missing <<END_OF_CHAPTER>> marker: {filepath}")
-            return False
-
-    except Exception as e:
-        print(f"Error validating {filepath}: {e}")
-        return False
-
 # --- UTILS ---
 
-def load_glossary(glossary_path):
-    if os.path.exists(glossary_path):
-        with open(glossary_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_glossary(glossary, glossary_path):
-    with open(glossary_path, "w", encoding="utf-8") as f:
-        json.dump(glossary, f, ensure_ascii=False, indent=4)
-
-def filter_glossary(text, full_glossary):
-    """Returns only glossary terms that appear in the text to save tokens."""
-    relevant = {}
-    for term, translation in full_glossary.items():
-        if term in text:
-            relevant[term] = translation
-    return relevant
-
 def estimate_tokens(text):
     """
     Heuristic for token counting (approximate).
+    Uses the cl100k_base tokenizer when tiktoken is available (close enough
+    to Qwen's for budgeting), otherwise:
     CJK char ~= 1.5 tokens (safe upper bound for Qwen)
     English word ~= 1.3 tokens
     """
+    if TOKEN_ENCODING is not None:
+        return len(TOKEN_ENCODING.encode(text, disallowed_special=()))
     return int(len(text) * 1.5)
 
 # --- RATE LIMITER ---
 
-class RateLimiter:
-    """
-    Strict Rate Limiter for Cerebras.
-    Limits: RPM 30, TPM 64,000
-    """
-    def __init__(self, rpm_limit=30, tpm_limit=64000):
-        self.rpm_limit = rpm_limit
-        self.tpm_limit = tpm_limit
-        self.request_timestamps = []
-        self.token_timestamps = [] 
-        self.lock = threading.Lock()
-
-    def _cleanup(self):
-        now = time.time()
-        # Keep data only for the last 60 seconds
-        self.request_timestamps = [t for t in self.request_timestamps if now - t < 60]
-        self.token_timestamps = [(t, c) for t, c in self.token_timestamps if now - t < 60]
-
-    def wait_if_needed(self, estimated_tokens=0):
-        with self.lock:
-            while True:
-                self._cleanup()
-                current_rpm = len(self.request_timestamps)
-                current_tpm = sum(c for t, c in self.token_timestamps)
-                
-                # Check limits
-                if current_rpm < self.rpm_limit and (current_tpm + estimated_tokens) <= self.tpm_limit:
-                    break
-                
-                # Debug print if waiting
-                if current_rpm >= self.rpm_limit:
-                    print(f"   [Limit] RPM Hit ({current_rpm}/{self.rpm_limit}). Waiting...")
-                if (current_tpm + estimated_tokens) > self.tpm_limit:
-                    print(f"   [Limit] TPM Hit ({current_tpm + estimated_tokens}/{self.tpm_limit}). Waiting...")
-                
-                time.sleep(2) # Wait 2 seconds before checking again
-            
-            # Record usage
-            now = time.time()
-            self.request_timestamps.append(now)
-            self.token_timestamps.append((now, estimated_tokens))
-
 # Initialize with User Constraints
 rate_limiter = RateLimiter(rpm_limit=30, tpm_limit=64000)
 
 # --- MAIN PROCESS ---
 
-def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossary_path):
-    raw_path = os.path.join(raw_dir, chapter_filename)
-    translated_path = os.path.join(translated_dir, chapter_filename)
-    
-    with open(raw_path, "r", encoding="utf-8") as f:
-        text = f.read()
+HALLUCINATION_CHECK_EVERY = 50  # Stream chunks between loop checks
+HALLUCINATION_CHECK_CHUNKS = 1000  # How many recent chunks the check looks at
 
-    # Optimization: Filter glossary to save tokens
-    current_glossary = filter_glossary(text, glossary)
+def stream_completion(**kwargs):
+    """
+    Streams a chat completion and returns the full content, or None if the
+    output started looping and the stream was aborted early.
+    """
+    stream = client.chat.completions.create(stream=True, **kwargs)
+    parts = []
+    try:
+        for n, chunk in enumerate(stream, 1):
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            if n % HALLUCINATION_CHECK_EVERY == 0:
+                # The text is still JSON-escaped, so unescape newlines to get lines back
+                tail = "".join(parts[-HALLUCINATION_CHECK_CHUNKS:]).replace("\\n", "\n")
+                if check_hallucination(split_nonblank_lines(tail)):
+                    return None
+    finally:
+        stream.close()
+    return "".join(parts)
 
-    # 1. Estimate Tokens (Input + Expected Output)
-    input_est = estimate_tokens(text) + estimate_tokens(json.dumps(current_glossary)) + 500 # System prompt buffer
-    output_est = int(estimate_tokens(text) * 1.5) # Output usually larger than input
-    total_est = input_est + output_est
-    
-    # Check if a single chapter exceeds the TPM limit alone
-    if total_est > 64000:
-        print(f"⚠️  WARNING: Chapter {chapter_filename} estimated {total_est} tokens. This exceeds the 1-minute global limit.")
-        # We proceed, but the rate limiter will block subsequent requests for > 60s
-    
-    system_prompt = f"""
+# The instructions never change, so they are built once; only the filtered
+# glossary lines are spliced in per chapter.
+SYSTEM_PROMPT_HEAD = """
     You are a professional novel translator.
     
     CRITICAL INSTRUCTIONS:
     1. **NO SUMMARIZATION:** Translate every single sentence. Do not skip scenes.
     2. **FORMAT:** Output strict Markdown. Use double newlines for paragraphs.
     3. **GLOSSARY:** Strictly follow these terms:
-    {json.dumps(current_glossary, ensure_ascii=False)}
+    """
+SYSTEM_PROMPT_TAIL = """
     
     4. **OUTPUT FORMAT:** Return ONLY a valid JSON object. Do not wrap in markdown code blocks like ```json.
     Structure:
-    {{
+    {
         "translated_text": "The full markdown translation... <<END_OF_CHAPTER>>",
-        "new_terms": [{{"original_term": "Name", "english_translation": "Name"}}]
-    }}
+        "new_terms": [{"original_term": "Name", "english_translation": "Name"}]
+    }
     
     Append <<END_OF_CHAPTER>> at the very end of the translated text string.
     """
 
+def process_chapter(chapter_filename, text, glossary, glossary_index, translated_dir, glossary_path):
+    """Translates one chapter; text is the raw source already read by process_book."""
+    translated_path = os.path.join(translated_dir, chapter_filename)
+
+    # Optimization: Filter glossary to save tokens
+    # (under the lock, since other workers may be adding terms concurrently)
+    with glossary_lock:
+        current_glossary = filter_glossary(text, glossary, glossary_index)
+
+    # 1. Estimate Tokens (Input + Expected Output)
+    glossary_lines = format_glossary(current_glossary)
+    text_est = estimate_tokens(text)
+    input_est = text_est + estimate_tokens(glossary_lines) + 500 # System prompt buffer
+    output_est = int(text_est * 1.5) # Output usually larger than input
+    total_est = input_est + output_est
+    
+    # Check if a single chapter exceeds the TPM limit alone
+    if total_est > 64000:
+        print(f"⚠️  WARNING: Chapter {chapter_filename} estimated {total_est} tokens. This exceeds the 1-minute global limit.")
+        # We proceed, but the rate limiter will block subsequent requests for > 60s
+    
+    system_prompt = SYSTEM_PROMPT_HEAD + glossary_lines + SYSTEM_PROMPT_TAIL
+
     user_prompt = f"Translate:\n\n{text}"
 
     max_retries = 3
@@ -251,8 +149,8 @@ def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossar
             
             print(f"[{chapter_filename}] Sending to Cerebras (Est. {total_est} tokens)...")
             
-            # Cerebras Chat Completion Call
-            response = client.chat.completions.create(
+            # Cerebras Chat Completion Call (streamed, so a looping response is cut short)
+            response_content = stream_completion(
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -262,43 +160,37 @@ def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossar
                 temperature=0.7,
                 top_p=0.9
             )
+            if response_content is None:
+                print(f"[{chapter_filename}] Hallucination detected mid-stream, aborted (Attempt {attempt+1}).")
+                continue
             
             # Parse Response
-            response_content = response.choices[0].message.content
-            result = json.loads(response_content)
+            result = json_loads(response_content)
             
             final_text = result.get("translated_text", "")
             new_terms_list = result.get("new_terms", [])
             
-            # Save
+            # Save even a failed attempt, so --fix-only can find it later
             with open(translated_path, "w", encoding="utf-8") as f:
                 f.write(final_text)
             
-            # Validate
-            if validate_translation(translated_path, source_text=text):
-                # Update Glossary
-                if new_terms_list:
-                    with glossary_lock:
-                        unique_terms = {t['original_term']: t['english_translation'] for t in new_terms_list}
-                        if unique_terms:
-                            print(f"[{chapter_filename}] Found {len(unique_terms)} new terms.")
-                            for k, v in unique_terms.items():
-                                glossary[k] = v
-                            save_glossary(glossary, glossary_path)
+            # Validate the response we already hold instead of reading the file back
+            if validate_text(final_text, translated_path, source_text=text):
+                merge_new_terms(chapter_filename, new_terms_list, glossary, glossary_index, glossary_path, glossary_lock)
                 
                 print(f"[{chapter_filename}] ✅ DONE.")
                 return 
             else:
                 print(f"[{chapter_filename}] Validation failed (Attempt {attempt+1}).")
-                time.sleep(2)
                 
         except Exception as e:
             print(f"[{chapter_filename}] Error: {e}")
             if "429" in str(e):
                 print("Rate limit hit hard. Sleeping 30s...")
                 time.sleep(30)
-            else:
-                time.sleep(5)
+            elif attempt + 1 < max_retries:
+                # A bad response is retried right away; only errors back off
+                time.sleep(backoff_delay(attempt))
 
     print(f"[{chapter_filename}] ❌ FAILED after retries.")
 
@@ -310,27 +202,39 @@ def process_book(book_dir, args):
     
     os.makedirs(translated_dir, exist_ok=True)
     glossary = load_glossary(glossary_path)
+    if os.path.exists(glossary_path + "l"):
+        save_glossary(glossary, glossary_path)  # Fold in terms left by an interrupted run
+    glossary_index = build_glossary_index(glossary)
 
     if not os.path.exists(raw_dir): return
 
-    chapters = sorted([f for f in os.listdir(raw_dir) if f.endswith(".txt")])
+    # One directory walk each instead of an exists()/stat() per chapter;
+    # on Windows DirEntry.stat() comes straight from the directory listing
+    with os.scandir(raw_dir) as it:
+        raw_entries = numbered_chapters(it)
+    with os.scandir(translated_dir) as it:
+        translated_entries = {e.name: e for e in it if e.name.endswith(".txt")}
     chapters_to_translate = []
     
+    # Validation results keyed on the (mtime, size) of both files, so unchanged
+    # translations are not re-read and re-scanned on every run
+    validation_cache_path = os.path.join(translated_dir, VALIDATION_CACHE_FILE)
+    # --reaudit drops cached results, e.g. after the validation rules change
+    validation_cache = {} if args.reaudit else load_validation_cache(validation_cache_path)
+    
     # Validation stats
     passed = 0
     failed = 0
 
     print("Checking existing files...")
 
-    for chapter_file in chapters:
-        try:
-            chapter_num = int(chapter_file.split("_")[1].split(".")[0])
-        except: continue
+    for chapter_num, raw_entry in raw_entries:
+        chapter_file = raw_entry.name
 
         if args.chapters and chapter_num not in args.chapters: continue
 
-        raw_path = os.path.join(raw_dir, chapter_file)
-        translated_path = os.path.join(translated_dir, chapter_file)
+        raw_path = raw_entry.path
+        translated_entry = translated_entries.get(chapter_file)
         
         # We MUST load source text to perform strict validation (ratio/line count)
         try:
@@ -340,10 +244,20 @@ def process_book(book_dir, args):
             print(f"Skipping {chapter_file} (Cannot read raw).")
             continue
 
-        if os.path.exists(translated_path):
+        if translated_entry is not None:
             if not args.force:
-                # DEEP VALIDATION: Pass source_text to check ratios/line counts
-                if validate_translation(translated_path, source_text=source_text):
+                trans_st = translated_entry.stat()
+                raw_st = raw_entry.stat()
+                key = [trans_st.st_mtime_ns, trans_st.st_size, raw_st.st_mtime_ns, raw_st.st_size]
+                cached = validation_cache.get(chapter_file)
+                if cached and cached["key"] == key:
+                    is_valid = cached["ok"]
+                else:
+                    # DEEP VALIDATION: Pass source_text to check ratios/line counts
+                    is_valid = validate_translation(translated_entry.path, source_text=source_text)
+                    validation_cache[chapter_file] = {"key": key, "ok": is_valid}
+                
+                if is_valid:
                     passed += 1
                     # It's good! Skip it.
                     continue 
@@ -359,7 +273,10 @@ def process_book(book_dir, args):
                 continue
         
         # If we are here, it needs translation
-        chapters_to_translate.append(chapter_file)
+        # Keep the source text so process_chapter doesn't read it again
+        chapters_to_translate.append((chapter_file, source_text))
+
+    save_validation_cache(validation_cache, validation_cache_path)
 
     if args.audit:
         print(f"\n[AUDIT REPORT] Passed: {passed} | Failed/Missing: {failed}")
@@ -371,8 +288,17 @@ def process_book(book_dir, args):
 
     print(f"\nQueue size: {len(chapters_to_translate)} chapters to translate.")
 
-    for i, chapter_file in enumerate(chapters_to_translate):
-        process_chapter(chapter_file, glossary, raw_dir, translated_dir, glossary_path)
+    # Requests are network-bound, so a few threads keep the RPM/TPM budget busy.
+    # rate_limiter and glossary_lock are the only shared state between workers.
+    workers = max(1, min(8, args.workers))
+    run_in_pool(
+        lambda item: process_chapter(item[0], item[1], glossary, glossary_index, translated_dir, glossary_path),
+        chapters_to_translate, workers, label=lambda item: item[0]
+    )
+
+    # Compact the journal back into the pretty JSON once the workers are done
+    if os.path.exists(glossary_path + "l"):
+        save_glossary(glossary, glossary_path)
 
     # Site Generation
     try:
@@ -388,6 +314,8 @@ def main():
     parser.add_argument("--library_dir", type=str)
     parser.add_argument("--fix-only", action="store_true", help="Only fix broken chapters, do not translate new ones.")
     parser.add_argument("--audit", action="store_true", help="Run validation only and report failures. Does not translate.")
+    parser.add_argument("--reaudit", action="store_true", help="Re-validate every translated chapter, ignoring cached results.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of chapters to translate concurrently (max 8).")
     args = parser.parse_args()
 
     prevent_sleep()
@@ -1,13 +1,20 @@
 import os
-import json
+import re
+import math
 import google.generativeai as genai
 from dotenv import load_dotenv
 import time
 import typing_extensions as typing
 import argparse
-import ctypes
 import threading
 import generate_site
+from translator_core import (
+    RateLimiter, run_in_pool, json_loads, json_dumps, load_glossary, save_glossary,
+    build_glossary_index, filter_glossary, merge_new_terms,
+    split_nonblank_lines, check_refusal, check_hallucination, validate_translation, validate_text,
+    END_MARKER_TAIL_BYTES, VALIDATION_CACHE_FILE, load_validation_cache, save_validation_cache,
+    numbered_chapters, make_batches, backoff_delay, prevent_sleep, allow_sleep,
+)
 
 # Load environment variables
 load_dotenv()
@@ -17,41 +24,21 @@ if not API_KEY:
     print("WARNING: GEMINI_API_KEY not found in .env file. Ensure it is set in environment.")
 
 try:
-    genai.configure(api_key=API_KEY)
+    # gRPC keeps one HTTP/2 channel open and multiplexes every worker's
+    # requests over it, instead of a new TLS handshake per chapter
+    genai.configure(api_key=API_KEY, transport="grpc")
 except Exception as e:
     print(f"Error configuring API: {e}")
 
-# Configuration
-MODEL_NAME = "gemini-2.5-flash" 
 # Configuration
 MODEL_NAME = "gemini-2.5-flash" 
 DEFAULT_RAW_DIR = "raw_chapters"
 DEFAULT_TRANSLATED_DIR = "translated_chapters"
 DEFAULT_GLOSSARY_FILE = "glossary.json"
 
-# Thread synchronization (still good practice even if sequential, for future proofing)
+# Thread synchronization (chapters are translated by a thread pool)
 glossary_lock = threading.Lock()
 
-# Windows Sleep Prevention Constants
-ES_CONTINUOUS = 0x80000000
-ES_SYSTEM_REQUIRED = 0x00000001
-
-def prevent_sleep():
-    """Prevents the system from entering sleep mode."""
-    try:
-        print("Preventing system sleep...")
-        ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS | ES_SYSTEM_REQUIRED)
-    except AttributeError:
-        pass
-
-def allow_sleep():
-    """Allows the system to sleep again."""
-    try:
-        print("Allowing system sleep...")
-        ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS)
-    except AttributeError:
-        pass
-
 # Define the output schema
 class TermEntry(typing.TypedDict):
     original_term: str
@@ -60,182 +47,246 @@ class TermEntry(typing.TypedDict):
 class TranslationOutput(typing.TypedDict):
     translated_text: str
     new_terms: list[TermEntry]
-    thought: str  # Added for Chain of Thought
+    # thought: str  <-- REMOVED to save tokens
 
-class RateLimiter:
-    """
-    Simple Rate Limiter for RPM and TPM.
-    """
-    def __init__(self, rpm_limit=10, tpm_limit=100000):
-        self.rpm_limit = rpm_limit
-        self.tpm_limit = tpm_limit
-        self.request_timestamps = []
-        self.token_timestamps = [] # List of (timestamp, token_count)
-        self.lock = threading.Lock()
-
-    def _cleanup(self):
-        now = time.time()
-        # Remove timestamps older than 60 seconds
-        self.request_timestamps = [t for t in self.request_timestamps if now - t < 60]
-        self.token_timestamps = [(t, c) for t, c in self.token_timestamps if now - t < 60]
-
-    def wait_if_needed(self, estimated_tokens=0):
-        with self.lock:
-            while True:
-                self._cleanup()
-                
-                # Check RPM
-                current_rpm = len(self.request_timestamps)
-                
-                # Check TPM
-                current_tpm = sum(c for t, c in self.token_timestamps)
-                
-                if current_rpm < self.rpm_limit and (current_tpm + estimated_tokens) <= self.tpm_limit:
-                    break
-                
-                # Wait a bit
-                time.sleep(1)
-            
-            # Record this request
-            now = time.time()
-            self.request_timestamps.append(now)
-            if estimated_tokens > 0:
-                self.token_timestamps.append((now, estimated_tokens))
+class BatchTranslationOutput(typing.TypedDict):
+    chapter_id: str
+    translated_text: str
+    new_terms: list[TermEntry]
 
-# Global Rate Limiter
+# Global Rate Limiter (waits proactively, so 429s should be rare)
 rate_limiter = RateLimiter(rpm_limit=10, tpm_limit=100000)
 
-def check_hallucination(text):
-    """
-    Simple check for repetitive loops (hallucinations).
-    Returns True if hallucination detected.
-    """
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    if len(lines) < 10:
-        return False
-        
-    # Check for immediate repetition of the same line multiple times
-    for i in range(len(lines) - 5):
-        chunk = lines[i:i+5]
-        # If the next 5 lines are exactly the same as this chunk
-        if i + 10 <= len(lines):
-            next_chunk = lines[i+5:i+10]
-            if chunk == next_chunk and chunk[0] == chunk[1]: # Strong repetition
-                 return True
-                 
-    # Check for single line repeating many times
-    from collections import Counter
-    counts = Counter(lines)
-    most_common = counts.most_common(1)
-    if most_common:
-        line, count = most_common[0]
-        if count > 10 and len(line) > 5: # Arbitrary threshold
-            return True
-            
-    return False
+# Gemini 429s carry the server's suggested wait, e.g. "retry_delay { seconds: 34 }"
+# or "Please retry in 34.2s."
+RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)|retry in ([\d.]+)s", re.IGNORECASE)
+
+def retry_delay_from_error(error_str):
+    """Returns the retry delay in seconds suggested by a 429 error, or None."""
+    match = RETRY_DELAY_RE.search(error_str)
+    if match:
+        return float(match.group(1) or match.group(2))
+    return None
 
-def check_refusal(text):
+def estimate_tokens(text):
     """
-    Checks if the text looks like an AI refusal.
+    Rough Gemini token count: ~1 token per CJK character, ~4 characters
+    per token for everything else (English, JSON, markup).
     """
-    refusal_keywords = [
-        "I cannot translate", "I can't translate", "I am unable to translate",
-        "As an AI language model",
-        "violate my safety guidelines", "against my content policy"
-    ]
-    lower_text = text.lower()
-    for keyword in refusal_keywords:
-        if keyword.lower() in lower_text:
-            return True
-    return False
+    # CJK characters take 3 bytes in UTF-8 and ASCII takes 1, so the byte
+    # surplus counts the wide characters without a Python-level loop
+    wide = (len(text.encode('utf-8')) - len(text)) // 2
+    return wide + (len(text) - wide) // 4
+
+# Gemini's validation rules for translator_core: it sometimes closes with its
+# own "(End of Chapter)" instead of <<END_OF_CHAPTER>>, its loop check only
+# counts repeats that open with a doubled line (plus any line repeated over
+# 10 times), and shorter chapters already get the paragraph check
+END_MARKER_RE = re.compile(rb"<<END_OF_CHAPTER>>|end of chapter", re.IGNORECASE)
+LOOP_RULES = {"doubled_start": True, "max_line_repeats": 10}
+VALIDATION_RULES = {"end_marker_re": END_MARKER_RE, "min_source_lines": 10, **LOOP_RULES}
+
+# The model object and the instruction text never change, so they are built
+# once; only the filtered glossary and the chapter text are spliced in.
+MODEL = genai.GenerativeModel(MODEL_NAME)
+GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=TranslationOutput
+)
+
+PROMPT_HEAD = """
+    Translate the following novel chapter into English. 
+    
+    CRITICAL INSTRUCTIONS:
+    1. **NO SUMMARIZATION:** You must translate every single sentence. Do not skip scenes, dialogue, or internal monologues.
+    2. **FORMAT:** Output strict Markdown. Use double newlines for paragraphs.
+    3. **GLOSSARY:** Strictly follow: """
+PROMPT_MID = """
+    4. **NEW TERMS:** Identify NEW proper nouns not in the glossary.
+    
+    Structure your JSON response exactly like this:
+    {
+        "translated_text": "The full markdown translation...",
+        "new_terms": [
+             {"original_term": "Name", "english_translation": "Name"}
+        ]
+    }
+    
+    (Note: Do not include a 'thought' field. Go straight to translation.)
 
-def filter_glossary(text, full_glossary):
+    End the "translated_text" string with: <<END_OF_CHAPTER>>
+    
+    Original Text:
     """
-    Returns a subset of the glossary containing only terms found in the text.
+PROMPT_TAIL = """
     """
-    relevant_glossary = {}
+
+# Batch mode (--batch-size > 1): several short chapters share one request,
+# since Gemini's RPM limit binds long before its TPM limit.
+BATCH_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=list[BatchTranslationOutput]
+)
+BATCH_MAX_CHARS = 30000  # Keep a batch's combined output well under the model's output limit
+
+BATCH_PROMPT_HEAD = """
+    Translate each of the following novel chapters into English. 
     
-    # Iterate through the glossary
-    for term, translation in full_glossary.items():
-        # Check if the original term exists in the text
-        # simple 'in' check is fast and handles most CJK/English cases
-        if term in text:
-            relevant_glossary[term] = translation
-            
-    return relevant_glossary
+    CRITICAL INSTRUCTIONS:
+    1. **NO SUMMARIZATION:** You must translate every single sentence of every chapter. Do not skip scenes, dialogue, or internal monologues.
+    2. **FORMAT:** Output strict Markdown. Use double newlines for paragraphs.
+    3. **GLOSSARY:** Strictly follow: """
+BATCH_PROMPT_MID = """
+    4. **NEW TERMS:** Identify NEW proper nouns not in the glossary.
+    
+    Each chapter is wrapped in "=== CHAPTER <id> START ===" and "=== CHAPTER <id> END ===".
+    Return a JSON list with one object per chapter, in the same order:
+    [
+        {
+            "chapter_id": "<id>",
+            "translated_text": "The full markdown translation...",
+            "new_terms": [
+                 {"original_term": "Name", "english_translation": "Name"}
+            ]
+        }
+    ]
 
-def load_glossary(glossary_path):
-    if os.path.exists(glossary_path):
-        with open(glossary_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    End every "translated_text" string with: <<END_OF_CHAPTER>>
+    
+    Original Chapters:
+    """
 
-def save_glossary(glossary, glossary_path):
-    with open(glossary_path, "w", encoding="utf-8") as f:
-        json.dump(glossary, f, ensure_ascii=False, indent=4)
+STREAM_CHECK_CHARS = 4000  # Streamed characters between refusal/loop checks
+STREAM_CHECK_TAIL = 20000  # How much of the recent output each check looks at
 
-def validate_translation(filepath, source_text=None):
+def stream_generate(prompt, generation_config):
     """
-    Robustly checks if the translation is valid, complete, and not a summary.
+    Streams a Gemini response and returns (text, aborted). aborted is None for
+    a complete response, or "refusal" / "loop" when the output turned into one
+    and the stream was abandoned early, in which case text is None.
     """
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-            if not content.strip():
-                print(f"❌ Validation Failed: Empty content in {filepath}")
-                return False
-            
-            # 1. Refusal Check
-            if check_refusal(content):
-                print(f"❌ Validation Failed: AI Refusal detected in {filepath}")
-                return False
-
-            # 2. Hallucination Check
-            if check_hallucination(content):
-                print(f"❌ Validation Failed: Hallucination detected in {filepath}")
-                return False
-
-            if source_text:
-                len_source = len(source_text)
-                len_trans = len(content)
-                
-                # 3. Strict Length Ratio Check
-                # English text is usually 1.2x - 2.0x longer than Chinese/CJK.
-                # If it's less than 0.6x, it's almost certainly a summary or truncation.
-                ratio = len_trans / len_source
-                if ratio < 0.6: 
-                    print(f"❌ Validation Failed: Suspiciously short ({ratio:.2f}x source). Likely a summary.")
-                    return False
-                
-                # 4. Paragraph/Line Count Check (Crucial for 'Middle Skip' detection)
-                # Count non-empty lines
-                source_lines = len([x for x in source_text.split('\n') if x.strip()])
-                trans_lines = len([x for x in content.split('\n') if x.strip()])
-                
-                # If translation has fewer than 50% of the source lines, it skipped content.
-                # (English dialogue sometimes combines lines, but 50% is a safe floor)
-                if source_lines > 10 and trans_lines < (source_lines * 0.5):
-                    print(f"❌ Validation Failed: Paragraph mismatch. Source: {source_lines}, Trans: {trans_lines}. Content likely skipped.")
-                    return False
-
-            # 5. End Marker Check
-            if "<<END_OF_CHAPTER>>" in content:
-                return True
-            
-            # Fallback markers
-            content_lower = content.lower()
-            if "(end of chapter)" in content_lower or "end of chapter" in content_lower:
-                return True
-            
-            print(f"❌ Validation Failed: Missing End Marker in {filepath}. Likely truncated due to token limit.")
-            return False
-
-    except Exception as e:
-        print(f"Error validating {filepath}: {e}")
-        return False
+    response = MODEL.generate_content(prompt, generation_config=generation_config, stream=True)
+    parts = []
+    size = 0
+    next_check = STREAM_CHECK_CHARS
+    for chunk in response:
+        parts.append(chunk.text)
+        size += len(parts[-1])
+        if size >= next_check:
+            next_check = size + STREAM_CHECK_CHARS
+            # The text is still JSON-escaped, so unescape newlines to get lines back
+            tail = "".join(parts)[-STREAM_CHECK_TAIL:].replace("\\n", "\n")
+            if check_refusal(tail, edges_only=True):
+                return None, "refusal"
+            if check_hallucination(split_nonblank_lines(tail), **LOOP_RULES):
+                return None, "loop"
+    return "".join(parts), None
+
+SPLIT_MIN_CHARS = 2000  # Shorter chapters are not worth retrying in halves
+SHARD_TPM_SHARE = 0.8  # Prompts estimated above this share of the TPM limit are sent in shards
+PART_RETRIES = 2
+# The end marker(s) at the close of a part, removed before the parts are joined
+END_MARKER_SUFFIX_RE = re.compile(r"(?:\s*(?:<<END_OF_CHAPTER>>|\(?end of chapter\)?))+\s*$", re.IGNORECASE)
+
+def looks_truncated(translated, source_text):
+    """True if a response lost its end marker or is far shorter than the source."""
+    if not END_MARKER_RE.search(translated[-END_MARKER_TAIL_BYTES:].encode('utf-8')):
+        return True
+    return len(translated) < 0.6 * len(source_text)
+
+def split_at_paragraph(text):
+    """Splits text at the line break nearest its middle; None if there is none."""
+    mid = len(text) // 2
+    cuts = [i for i in (text.rfind("\n", 0, mid), text.find("\n", mid)) if i > 0]
+    if not cuts:
+        return None
+    cut = min(cuts, key=lambda i: abs(i - mid))
+    return text[:cut], text[cut + 1:]
+
+def split_into_shards(text, max_chars):
+    """Groups whole lines into shards of up to max_chars (a longer line is a shard of its own)."""
+    shards = []
+    current = []
+    size = 0
+    for line in text.split("\n"):
+        if current and size + len(line) > max_chars:
+            shards.append("\n".join(current))
+            current = []
+            size = 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        shards.append("\n".join(current))
+    return shards
+
+def translate_part(chapter_filename, label, part, glossary, glossary_index):
+    """
+    Translates one part of a chapter, retrying a bad response. Returns
+    (translated_text, new_terms, aborted); aborted is "refusal" when the model
+    refused the part, and translated_text is None whenever it failed.
+    """
+    for attempt in range(PART_RETRIES):
+        # Filtered per attempt, so terms found in earlier parts are picked up
+        with glossary_lock:
+            part_glossary = filter_glossary(part, glossary, glossary_index)
+        prompt = PROMPT_HEAD + json_dumps(part_glossary) + PROMPT_MID + part + PROMPT_TAIL
+        try:
+            rate_limiter.wait_if_needed(estimate_tokens(prompt))
+
+            print(f"[{chapter_filename}] Translating {label} (Attempt {attempt + 1})...")
+            response_text, aborted = stream_generate(prompt, GENERATION_CONFIG)
+            if aborted == "refusal":
+                print(f"[{chapter_filename}] {label} refused by the model mid-stream.")
+                return None, [], "refusal"
+            if aborted:
+                print(f"[{chapter_filename}] {label} aborted mid-stream ({aborted}).")
+                continue
+            result = json_loads(response_text)
+            part_text = result["translated_text"]
+            if validate_text(part_text, f"{chapter_filename} ({label})", source_text=part, **VALIDATION_RULES):
+                return part_text, result.get("new_terms", []), None
+            if check_refusal(part_text):
+                print(f"[{chapter_filename}] {label} refused by the model.")
+                return None, [], "refusal"
+        except Exception as e:
+            error_str = str(e)
+            if "429" in error_str or "Resource has been exhausted" in error_str:
+                wait_time = retry_delay_from_error(error_str) or backoff_delay(attempt)
+                print(f"[{chapter_filename}] Rate limit hit on {label}. Waiting {wait_time}s...")
+                time.sleep(wait_time)
+            else:
+                print(f"[{chapter_filename}] Error translating {label}: {e}")
+    return None, [], None
 
-def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossary_path):
+def save_parts_translation(chapter_filename, text, parts, glossary, glossary_index, translated_path, glossary_path):
+    """
+    Translates text one part at a time, then saves and validates the joined
+    result. Returns "SUCCESS", "REFUSED" or "FAILED".
+    """
+    translated = []
+    for n, part in enumerate(parts, 1):
+        part_text, new_terms_list, aborted = translate_part(
+            chapter_filename, f"part {n}/{len(parts)}", part, glossary, glossary_index
+        )
+        if aborted == "refusal":
+            return "REFUSED"
+        if part_text is None:
+            return "FAILED"
+        translated.append(part_text)
+        # Merged right away, so later parts translate names the same way
+        merge_new_terms(chapter_filename, new_terms_list, glossary, glossary_index, glossary_path, glossary_lock)
+
+    # Only the last part's end marker closes the chapter
+    body = [END_MARKER_SUFFIX_RE.sub("", t) for t in translated[:-1]] + translated[-1:]
+    final_text = "\n\n".join(body)
+    with open(translated_path, "w", encoding="utf-8") as f:
+        f.write(final_text)
+    if not validate_text(final_text, translated_path, source_text=text, **VALIDATION_RULES):
+        return "FAILED"
+    print(f"[{chapter_filename}] DONE and Saved (translated in {len(parts)} parts).")
+    return "SUCCESS"
+
+def process_chapter(chapter_filename, glossary, glossary_index, raw_dir, translated_dir, glossary_path):
     """
     Handles the full process for a single chapter: Translate Full Text -> Save -> Update Glossary.
     """
@@ -244,55 +295,39 @@ def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossar
     
     with open(raw_path, "r", encoding="utf-8") as f:
         text = f.read()
-        
+
         # --- NEW STEP: Filter Glossary ---
-    current_chapter_glossary = filter_glossary(text, glossary)
+    # (under the lock, since other workers may be adding terms concurrently)
+    with glossary_lock:
+        current_chapter_glossary = filter_glossary(text, glossary, glossary_index)
+        total_terms = len(glossary)
 
         # Calculate stats for logging
-    total_terms = len(glossary)
     filtered_terms = len(current_chapter_glossary)
     if filtered_terms < total_terms:
         print(f"[{chapter_filename}] Glossary optimization: Using {filtered_terms}/{total_terms} terms.")
         
-    model = genai.GenerativeModel(MODEL_NAME)
-
-# Update the Prompt in process_chapter
-    prompt = f"""
-    Translate the following novel chapter into English. 
-    
-    CRITICAL INSTRUCTIONS:
-    1. **NO SUMMARIZATION:** You must translate every single sentence. Do not skip scenes, dialogue, or internal monologues.
-    2. **FORMAT:** Output strict Markdown. Use double newlines for paragraphs.
-    3. **GLOSSARY:** Strictly follow: {json.dumps(current_chapter_glossary, ensure_ascii=False)}
-    4. **NEW TERMS:** Identify NEW proper nouns not in the glossary.
-    
-    Structure your JSON response exactly like this:
-    {{
-        "translated_text": "The full markdown translation...",
-        "new_terms": [
-             {{"original_term": "Name", "english_translation": "Name"}}
-        ]
-    }}
+    prompt = PROMPT_HEAD + json_dumps(current_chapter_glossary) + PROMPT_MID + text + PROMPT_TAIL
     
-    (Note: Do not include a 'thought' field. Go straight to translation.)
-
-    End the "translated_text" string with: <<END_OF_CHAPTER>>
-    
-    Original Text:
-    {text}
-    """
-    
-    # Update schema to remove thought
-    class TranslationOutput(typing.TypedDict):
-        translated_text: str
-        new_terms: list[TermEntry]
-        # thought: str  <-- REMOVED to save tokens
-
     max_retries = 2
     base_delay = 10
     
-    # Estimate tokens (rough char count / 4)
-    estimated_tokens = len(prompt) // 4
+    # Estimate tokens (CJK-aware; a plain char count / 4 undercounts Chinese ~4x)
+    estimated_tokens = estimate_tokens(prompt)
+    truncated = False
+
+    # A prompt that would take most of the TPM budget goes out as a few
+    # smaller requests instead, just enough to fit each one comfortably
+    shard_budget = SHARD_TPM_SHARE * rate_limiter.tpm_limit
+    if estimated_tokens > shard_budget:
+        shard_chars = math.ceil(len(text) / math.ceil(estimated_tokens / shard_budget))
+        shards = split_into_shards(text, shard_chars)
+        status = save_parts_translation(chapter_filename, text, shards, glossary, glossary_index, translated_path, glossary_path)
+        if status == "REFUSED":
+            print(f"[{chapter_filename}] Refused by the model. Not retrying.")
+        elif status == "FAILED":
+            print(f"[{chapter_filename}] Translating in {len(shards)} parts failed.")
+        return
 
     for attempt in range(max_retries):
         try:
@@ -300,49 +335,56 @@ def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossar
             rate_limiter.wait_if_needed(estimated_tokens)
 
             print(f"[{chapter_filename}] Translating (Attempt {attempt + 1})...")
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.GenerationConfig(
-                    response_mime_type="application/json",
-                    response_schema=TranslationOutput
-                )
-            )
-            
-            result = json.loads(response.text)
+            # Streamed, so a refusal or a looping response is cut short
+            response_text, aborted = stream_generate(prompt, GENERATION_CONFIG)
+            if aborted == "refusal":
+                # Same as a refusal caught after the fact: the prompt will just be refused again
+                print(f"[{chapter_filename}] Refused by the model mid-stream. Not retrying.")
+                return
+            if aborted:
+                print(f"[{chapter_filename}] Loop detected mid-stream, aborted (Attempt {attempt + 1}).")
+                time.sleep(5)
+                continue
             
+            try:
+                result = json_loads(response_text)
+            except ValueError:
+                # Output that hits the token limit stops mid-string, so the JSON never closes
+                truncated = True
+                print(f"[{chapter_filename}] Response is not valid JSON, likely cut off. Retrying...")
+                time.sleep(5)
+                continue
+
             final_text = result["translated_text"]
             new_terms_list = result.get("new_terms", [])
             
-            # Temporary save for validation
+            # Save even a failed attempt, so --fix-only can find it later
             with open(translated_path, "w", encoding="utf-8") as f:
                 f.write(final_text)
                 
-            # Validate
-            if validate_translation(translated_path, source_text=text):
+            # Validate (from memory, no need to read the file back)
+            if validate_text(final_text, translated_path, source_text=text, **VALIDATION_RULES):
                 # Success!
                 
                 # Update Glossary (Thread-Safe)
-                if new_terms_list:
-                    with glossary_lock:
-                        # Deduplicate terms
-                        unique_terms = {t['original_term']: t['english_translation'] for t in new_terms_list}
-                        
-                        print(f"[{chapter_filename}] Found {len(unique_terms)} new terms. Updating glossary...")
-                        for original, english in unique_terms.items():
-                            glossary[original] = english
-                        save_glossary(glossary, glossary_path)
+                merge_new_terms(chapter_filename, new_terms_list, glossary, glossary_index, glossary_path, glossary_lock)
                 
                 print(f"[{chapter_filename}] DONE and Saved.")
                 return # Exit function on success
+            elif check_refusal(final_text):
+                # The same prompt will just be refused again
+                print(f"[{chapter_filename}] Refused by the model. Not retrying.")
+                return
             else:
+                truncated = looks_truncated(final_text, text)
                 print(f"[{chapter_filename}] Validation failed. Retrying...")
-                # If it was a validation failure, we might want to wait a bit or adjust prompt (not implemented here)
                 time.sleep(5)
             
         except Exception as e:
             error_str = str(e)
             if "429" in error_str or "Resource has been exhausted" in error_str:
-                wait_time = base_delay * (2 ** attempt)
+                # Prefer the server's hint over blind exponential backoff
+                wait_time = retry_delay_from_error(error_str) or base_delay * (2 ** attempt)
                 print(f"[{chapter_filename}] Rate limit hit. Waiting {wait_time}s...")
                 time.sleep(wait_time)
             else:
@@ -350,8 +392,76 @@ def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossar
                 # Don't return immediately, try to retry if it's a transient error
                 time.sleep(5)
 
+    # A response that keeps running out before the end usually fits in two smaller requests
+    if truncated and len(text) >= SPLIT_MIN_CHARS:
+        halves = split_at_paragraph(text)
+        if halves:
+            status = save_parts_translation(chapter_filename, text, halves, glossary, glossary_index, translated_path, glossary_path)
+            if status == "SUCCESS":
+                return
+            if status == "REFUSED":
+                print(f"[{chapter_filename}] Refused by the model. Not retrying.")
+                return
+
     print(f"[{chapter_filename}] Failed after {max_retries} retries.")
 
+def process_chapter_batch(chapter_files, glossary, glossary_index, raw_dir, translated_dir, glossary_path):
+    """
+    Translates several chapters in one request. Any chapter that is missing
+    from the response or fails validation falls back to process_chapter.
+    """
+    if len(chapter_files) == 1:
+        return process_chapter(chapter_files[0], glossary, glossary_index, raw_dir, translated_dir, glossary_path)
+
+    texts = {}
+    for chapter_filename in chapter_files:
+        with open(os.path.join(raw_dir, chapter_filename), "r", encoding="utf-8") as f:
+            texts[chapter_filename] = f.read()
+
+    with glossary_lock:
+        current_glossary = filter_glossary("\n".join(texts.values()), glossary, glossary_index)
+
+    chapters_block = "".join(
+        f"=== CHAPTER {name} START ===\n{text}\n=== CHAPTER {name} END ===\n"
+        for name, text in texts.items()
+    )
+    prompt = BATCH_PROMPT_HEAD + json_dumps(current_glossary) + BATCH_PROMPT_MID + chapters_block + PROMPT_TAIL
+    label = f"{chapter_files[0]}..{chapter_files[-1]}"
+
+    done = set()
+    try:
+        rate_limiter.wait_if_needed(estimate_tokens(prompt))
+        print(f"[{label}] Translating {len(chapter_files)} chapters in one request...")
+        response_text, aborted = stream_generate(prompt, BATCH_GENERATION_CONFIG)
+        if aborted:
+            # Every chapter falls back to its own request below
+            print(f"[{label}] Aborted mid-stream ({aborted}).")
+            results = {}
+        else:
+            results = {item.get("chapter_id"): item for item in json_loads(response_text)}
+
+        for chapter_filename, text in texts.items():
+            item = results.get(chapter_filename)
+            if not item or not item.get("translated_text"):
+                continue
+            translated_path = os.path.join(translated_dir, chapter_filename)
+            with open(translated_path, "w", encoding="utf-8") as f:
+                f.write(item["translated_text"])
+            if validate_text(item["translated_text"], translated_path, source_text=text, **VALIDATION_RULES):
+                merge_new_terms(chapter_filename, item.get("new_terms", []), glossary, glossary_index, glossary_path, glossary_lock)
+                print(f"[{chapter_filename}] DONE and Saved.")
+                done.add(chapter_filename)
+    except Exception as e:
+        error_str = str(e)
+        print(f"[{label}] Batch error: {e}")
+        if "429" in error_str or "Resource has been exhausted" in error_str:
+            time.sleep(retry_delay_from_error(error_str) or 10)
+
+    for chapter_filename in chapter_files:
+        if chapter_filename not in done:
+            print(f"[{chapter_filename}] Not translated by the batch, retrying on its own...")
+            process_chapter(chapter_filename, glossary, glossary_index, raw_dir, translated_dir, glossary_path)
+
 def process_book(book_dir, args):
     """
     Processes a single book directory.
@@ -361,43 +471,56 @@ def process_book(book_dir, args):
     raw_dir = os.path.join(book_dir, DEFAULT_RAW_DIR)
     translated_dir = os.path.join(book_dir, DEFAULT_TRANSLATED_DIR)
     glossary_path = os.path.join(book_dir, DEFAULT_GLOSSARY_FILE)
-    
-    # Fallback to global glossary if book-specific one doesn't exist
-    # User requested NO global fallback to save tokens. 
-    # So we just let it be empty.
-    pass
 
     os.makedirs(translated_dir, exist_ok=True)
     glossary = load_glossary(glossary_path)
+    if os.path.exists(glossary_path + "l"):
+        save_glossary(glossary, glossary_path)  # Fold in terms left by an interrupted run
+    glossary_index = build_glossary_index(glossary)
 
     # Get list of chapters and sort them
     if not os.path.exists(raw_dir):
         print(f"Directory {raw_dir} not found. Skipping.")
         return
 
-    chapters = sorted([f for f in os.listdir(raw_dir) if f.endswith(".txt")])
+    # One directory walk each instead of an exists() per chapter
+    with os.scandir(raw_dir) as it:
+        chapters = numbered_chapters(it)
+    with os.scandir(translated_dir) as it:
+        translated_entries = {e.name: e for e in it if e.name.endswith(".txt")}
+    selected = set(args.chapters) if args.chapters else None
+
+    # Validation results keyed on the translated file's (mtime, size), so
+    # unchanged translations are not re-read on every run
+    validation_cache_path = os.path.join(translated_dir, VALIDATION_CACHE_FILE)
+    # --reaudit drops cached results, e.g. after the validation rules change
+    validation_cache = {} if args.reaudit else load_validation_cache(validation_cache_path)
 
     # Filter chapters
     chapters_to_translate = []
-    for chapter_file in chapters:
-        # Extract number from filename "chapter_001.txt"
-        try:
-            chapter_num = int(chapter_file.split("_")[1].split(".")[0])
-        except:
-            continue
-
-        translated_path = os.path.join(translated_dir, chapter_file)
+    for chapter_num, raw_entry in chapters:
+        chapter_file = raw_entry.name
 
         # Check if this chapter is selected
-        if args.chapters and chapter_num not in args.chapters:
+        if selected and chapter_num not in selected:
             continue
 
         # Check if it already exists
-        if os.path.exists(translated_path):
+        translated_entry = translated_entries.get(chapter_file)
+        if translated_entry is not None:
             if not args.force:
-                # Check if the existing translation is complete
-                if validate_translation(translated_path):
-                    if args.chapters and chapter_num in args.chapters:
+                # Check if the existing translation is complete;
+                # DirEntry.stat() reuses the directory listing where the OS allows
+                st = translated_entry.stat()
+                key = [st.st_mtime_ns, st.st_size]
+                cached = validation_cache.get(chapter_file)
+                if cached and cached["key"] == key:
+                    is_valid = cached["ok"]
+                else:
+                    is_valid = validate_translation(translated_entry.path, **VALIDATION_RULES)
+                    validation_cache[chapter_file] = {"key": key, "ok": is_valid}
+                if is_valid:
+                    if selected:
                          print(f"Skipping {chapter_file} (already translated and valid). Use --force to overwrite.")
                     continue
                 else:
@@ -409,6 +532,8 @@ def process_book(book_dir, args):
 
         chapters_to_translate.append(chapter_file)
 
+    save_validation_cache(validation_cache, validation_cache_path)
+
     if args.limit and not args.chapters:
         chapters_to_translate = chapters_to_translate[:args.limit]
 
@@ -420,13 +545,27 @@ def process_book(book_dir, args):
         print(f"Chapters to process: {len(chapters_to_translate)}")
 
         try:
-            # SEQUENTIAL PROCESSING
-            for i, chapter_file in enumerate(chapters_to_translate):
-                print(f"\nProcessing {chapter_file} ({i+1}/{len(chapters_to_translate)})...")
-                process_chapter(chapter_file, glossary, raw_dir, translated_dir, glossary_path)
+            # The Gemini calls are network-bound, so a few threads overlap them;
+            # rate_limiter and glossary_lock are the only shared state.
+            workers = max(1, min(8, args.workers))
+            if args.batch_size > 1:
+                run_in_pool(
+                    lambda batch: process_chapter_batch(batch, glossary, glossary_index, raw_dir, translated_dir, glossary_path),
+                    make_batches(raw_dir, chapters_to_translate, args.batch_size, BATCH_MAX_CHARS), workers,
+                    label=lambda batch: f"{batch[0]}..{batch[-1]}"
+                )
+            else:
+                run_in_pool(
+                    lambda chapter_file: process_chapter(chapter_file, glossary, glossary_index, raw_dir, translated_dir, glossary_path),
+                    chapters_to_translate, workers
+                )
         except Exception as e:
             print(f"Error processing book {book_dir}: {e}")
 
+        # Compact the journal back into the pretty JSON
+        if os.path.exists(glossary_path + "l"):
+            save_glossary(glossary, glossary_path)
+
     # Automatically generate site for this book
     print(f"\nTriggering site regeneration for {book_dir}...")
     try:
@@ -442,6 +581,9 @@ def main():
     parser.add_argument("--chapters", type=int, nargs="+", help="Specific chapter numbers to translate (e.g. 1 5 10)")
     parser.add_argument("--force", action="store_true", help="Force re-translation even if file exists")
     parser.add_argument("--fix-only", action="store_true", help="Only re-translate broken chapters, do not translate new ones")
+    parser.add_argument("--reaudit", action="store_true", help="Re-validate every translated chapter, ignoring cached results")
+    parser.add_argument("--workers", type=int, default=3, help="Number of chapters to translate concurrently (max 8)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Translate up to this many short chapters per request (default 1: no batching)")
     
     # New arguments for multiple books
     parser.add_argument("--book_dir", type=str, help="Path to a specific book directory")
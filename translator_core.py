@@ -0,0 +1,413 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import threading
+import concurrent.futures
+from collections import Counter, deque
+
+# Provider-independent pieces shared by the translator scripts (tr_cerebras.py,
+# translate_epub.py, uni.py): glossary persistence and lookup, JSON helpers,
+# chapter file listing, translation validation and its cache, the RPM/TPM rate limiter, retry
+# backoff, the chapter thread pool and Windows sleep prevention.
+
+# Optional: orjson is a faster drop-in for the hot (de)serialization paths
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- JSON ---
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    """Compact JSON text with non-ASCII kept as-is."""
+    if orjson:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+# --- GLOSSARY ---
+
+def load_glossary(glossary_path):
+    glossary = {}
+    if os.path.exists(glossary_path):
+        with open(glossary_path, "rb") as f:
+            glossary = json_loads(f.read())
+    # Replay terms appended since the last full save
+    journal_path = glossary_path + "l"
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    glossary.update(json_loads(line))
+                except ValueError:
+                    pass  # Torn last line from an interrupted run
+    return glossary
+
+def save_glossary(glossary, glossary_path):
+    """Rewrites the full pretty glossary and drops the append journal."""
+    tmp_path = glossary_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(glossary, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, glossary_path)
+    if os.path.exists(glossary_path + "l"):
+        os.remove(glossary_path + "l")
+
+def append_glossary(new_terms, glossary_path):
+    """Appends only the new terms to glossary.jsonl; cheap enough to do under glossary_lock."""
+    with open(glossary_path + "l", "a", encoding="utf-8") as f:
+        f.write("".join(json_dumps({k: v}) + "\n" for k, v in new_terms.items()))
+
+def build_glossary_index(full_glossary):
+    """Buckets glossary terms by their first two characters for filter_glossary."""
+    index = {}
+    for term in full_glossary:
+        add_to_glossary_index(index, term)
+    return index
+
+def add_to_glossary_index(index, term):
+    index.setdefault(term[:2], []).append(term)
+
+def filter_glossary(text, full_glossary, index):
+    """
+    Returns only glossary terms that appear in the text to save tokens.
+    Only terms whose 2-char prefix occurs in the text get the full substring
+    check, instead of scanning the whole chapter once per glossary term.
+    """
+    prefixes = {text[i:i+2] for i in range(len(text))}  # bigrams plus the final char
+    prefixes.update(text)  # single-character terms
+    prefixes.add("")
+    hits = {term for prefix in prefixes & index.keys() for term in index[prefix] if term in text}
+    # Keep glossary order so the prompt is stable between runs
+    return {term: translation for term, translation in full_glossary.items() if term in hits}
+
+def format_glossary(glossary):
+    """One 'term => translation' line per entry; far fewer prompt tokens than JSON."""
+    return "\n".join(f"{term} => {translation}" for term, translation in glossary.items())
+
+def merge_new_terms(chapter_filename, new_terms_list, glossary, glossary_index, glossary_path, lock):
+    """Adds a validated chapter's new terms to the glossary, index and journal."""
+    if not new_terms_list:
+        return
+    # Deduplicate and drop already-known terms before taking the lock; the
+    # unlocked read only skips work, and the lock rechecks what is left
+    unique_terms = {t['original_term']: t['english_translation'] for t in new_terms_list}
+    candidates = {k: v for k, v in unique_terms.items() if glossary.get(k) != v}
+    if not candidates:
+        return
+    print(f"[{chapter_filename}] Found {len(candidates)} new terms.")
+    with lock:
+        # Only journal entries that actually add or change a term
+        changed = {k: v for k, v in candidates.items() if glossary.get(k) != v}
+        for k in changed.keys() - glossary.keys():
+            add_to_glossary_index(glossary_index, k)
+        glossary.update(changed)
+        if changed:
+            append_glossary(changed, glossary_path)
+
+# --- CHAPTER FILES ---
+
+# "chapter_001.txt" -> 1
+CHAPTER_FILE_RE = re.compile(r"[^_]*_(\d+)\.txt$")
+
+def numbered_chapters(entries):
+    """(number, DirEntry) for each chapter file in a scandir listing, in chapter order."""
+    chapters = []
+    for entry in entries:
+        match = CHAPTER_FILE_RE.match(entry.name)
+        if match and entry.is_file():
+            chapters.append((int(match.group(1)), entry))
+    # By number, so chapter_1000 follows chapter_999 rather than chapter_100
+    chapters.sort(key=lambda c: (c[0], c[1].name))
+    return chapters
+
+def make_batches(raw_dir, chapter_files, batch_size, max_chars):
+    """Groups consecutive chapters, up to batch_size and max_chars of raw text each."""
+    batches = []
+    current, current_size = [], 0
+    for chapter_filename in chapter_files:
+        size = os.path.getsize(os.path.join(raw_dir, chapter_filename)) // 3  # ~3 UTF-8 bytes per CJK char
+        if current and (len(current) >= batch_size or current_size + size > max_chars):
+            batches.append(current)
+            current, current_size = [], 0
+        current.append(chapter_filename)
+        current_size += size
+    if current:
+        batches.append(current)
+    return batches
+
+# --- VALIDATION ---
+
+# A line that holds anything besides whitespace, i.e. x.strip() is truthy
+NONBLANK_LINE_RE = re.compile(r"^[^\S\n]*\S", re.MULTILINE)
+
+def count_nonblank_lines(text):
+    """Number of non-blank lines, without splitting the text into a list."""
+    return len(NONBLANK_LINE_RE.findall(text))
+
+def split_nonblank_lines(text):
+    """Stripped non-empty lines, stripping each line only once."""
+    # map/filter keep the per-line loop in C
+    return list(filter(None, map(str.strip, text.split('\n'))))
+
+def check_hallucination(lines, doubled_start=False, max_line_repeats=None):
+    """
+    Checks the output of split_nonblank_lines for repetitive loops: a 5-line
+    window repeated right after itself (with doubled_start, only a window
+    that opens with a doubled line), or, with max_line_repeats, any line
+    longer than 5 characters that occurs more often than that.
+    """
+    if len(lines) < 10:
+        return False
+
+    # lines[i] == lines[i+step] is a cheap string compare, so windows are
+    # only sliced where a repeat has already started
+    step = 1 if doubled_start else 5
+    for i in range(len(lines) - 9):
+        if lines[i] == lines[i+step] and lines[i:i+5] == lines[i+5:i+10]:
+            return True
+
+    if max_line_repeats:
+        line, count = Counter(lines).most_common(1)[0]
+        if count > max_line_repeats and len(line) > 5:
+            return True
+    return False
+
+REFUSAL_KEYWORDS = [
+    "I cannot translate", "I can't translate", "unable to translate",
+    "AI language model", "content policy", "safety guidelines"
+]
+# Single case-insensitive pass over the text, no lowercased copy
+REFUSAL_RE = re.compile("|".join(re.escape(k) for k in REFUSAL_KEYWORDS), re.IGNORECASE)
+REFUSAL_SCAN_CHARS = 2048
+
+def check_refusal(text, edges_only=False):
+    """
+    Checks if the text looks like an AI refusal. Saved chapters are searched
+    in full, since a spliced or sharded chapter can hold a refusal anywhere.
+    """
+    if not edges_only:
+        return REFUSAL_RE.search(text) is not None
+    # For the repeated checks on a stream: a fresh refusal opens the response
+    # or is the newest output, so only the edges are searched; pos/endpos
+    # bound the scan without slicing a copy
+    return (REFUSAL_RE.search(text, 0, REFUSAL_SCAN_CHARS) is not None
+            or REFUSAL_RE.search(text, max(0, len(text) - REFUSAL_SCAN_CHARS)) is not None)
+
+# Every prompt asks for this marker at the very end of the translation, so
+# only the last END_MARKER_TAIL_BYTES are searched for it
+END_MARKER_RE = re.compile(rb"<<END_OF_CHAPTER>>")
+END_MARKER_TAIL_BYTES = 512
+
+def validate_translation(filepath, source_text=None, end_marker_re=END_MARKER_RE, **rules):
+    """
+    Checks that a saved translation is complete and not a refusal, loop or
+    summary. rules are passed on to validate_content.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                print(f"❌ Empty content: {filepath}")
+                return False
+
+            # The marker check only needs the tail, so a truncated file is
+            # rejected before the whole chapter is read
+            f.seek(max(0, size - END_MARKER_TAIL_BYTES))
+            if not end_marker_re.search(f.read()):
+                print(f"❌ Missing end marker: {filepath}. Likely truncated.")
+                return False
+
+            f.seek(0)
+            content = f.read().decode('utf-8')
+        return validate_content(content, filepath, source_text, **rules)
+
+    except Exception as e:
+        print(f"Error validating {filepath}: {e}")
+        return False
+
+def validate_text(content, filepath, source_text=None, end_marker_re=END_MARKER_RE, **rules):
+    """Same checks as validate_translation for a translation still in memory."""
+    try:
+        if not end_marker_re.search(content[-END_MARKER_TAIL_BYTES:].encode('utf-8')):
+            print(f"❌ Missing end marker: {filepath}. Likely truncated.")
+            return False
+        return validate_content(content, filepath, source_text, **rules)
+    except Exception as e:
+        print(f"Error validating {filepath}: {e}")
+        return False
+
+def validate_content(content, filepath, source_text=None, min_source_lines=20,
+                     doubled_start=False, max_line_repeats=None):
+    """
+    Checks shared by validate_translation and validate_text, after the end
+    marker. The paragraph check only applies to sources with more than
+    min_source_lines lines; the loop options go to check_hallucination.
+    """
+    if not content.strip():
+        print(f"❌ Empty content: {filepath}")
+        return False
+
+    if check_refusal(content):
+        print(f"❌ Refusal detected: {filepath}")
+        return False
+
+    # One split serves both the loop detector and the line count below
+    lines = split_nonblank_lines(content)
+    if check_hallucination(lines, doubled_start, max_line_repeats):
+        print(f"❌ Hallucination detected: {filepath}")
+        return False
+
+    if source_text:
+        # English is usually 1.2x - 2.0x longer than CJK; under 0.6x is
+        # almost certainly a summary
+        ratio = len(content) / len(source_text)
+        if ratio < 0.6:
+            print(f"❌ Text too short ({ratio:.2f}x source). Likely a summary.")
+            return False
+
+        # The "middle skip" detector: dialogue sometimes merges lines, but
+        # fewer than half the source lines means content was skipped
+        source_lines = count_nonblank_lines(source_text)
+        trans_lines = len(lines)
+        if source_lines > min_source_lines and trans_lines < (source_lines * 0.5):
+            print(f"❌ Paragraph mismatch (Source: {source_lines}, Trans: {trans_lines}). Content skipped.")
+            return False
+
+    return True
+
+# --- VALIDATION CACHE ---
+
+VALIDATION_CACHE_FILE = ".validation_cache.json"
+
+def load_validation_cache(cache_path):
+    """Per-chapter validation results from a previous run; empty if missing or unreadable."""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_validation_cache(cache, cache_path):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+# --- RATE LIMITER ---
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests per minute and tokens per minute.
+    Each script creates one with its provider's limits.
+    """
+    def __init__(self, rpm_limit, tpm_limit):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.request_timestamps = deque()
+        self.token_timestamps = deque()
+        self._token_sum = 0  # Running total of token_timestamps counts
+        self.cond = threading.Condition()
+
+    def _cleanup(self, now):
+        # Keep data only for the last 60 seconds
+        # Timestamps are appended in order, so expired entries are always on the left
+        while self.request_timestamps and now - self.request_timestamps[0] >= 60:
+            self.request_timestamps.popleft()
+        while self.token_timestamps and now - self.token_timestamps[0][0] >= 60:
+            _, count = self.token_timestamps.popleft()
+            self._token_sum -= count
+
+    def wait_if_needed(self, estimated_tokens=0):
+        with self.cond:
+            while True:
+                # monotonic() is immune to wall-clock jumps (NTP, sleep/resume)
+                now = time.monotonic()
+                self._cleanup(now)
+                current_rpm = len(self.request_timestamps)
+                current_tpm = self._token_sum
+                
+                # Check limits. A request estimated above the whole TPM budget
+                # could never fit, so it goes through once the window is empty.
+                tpm_ok = (current_tpm + estimated_tokens) <= self.tpm_limit or not self.token_timestamps
+                if current_rpm < self.rpm_limit and tpm_ok:
+                    break
+                
+                # Sleep exactly until the oldest entry blocking us leaves the window
+                wait_secs = 60
+                if current_rpm >= self.rpm_limit:
+                    print(f"   [Limit] RPM Hit ({current_rpm}/{self.rpm_limit}). Waiting...")
+                    wait_secs = min(wait_secs, 60 - (now - self.request_timestamps[0]))
+                if not tpm_ok:
+                    print(f"   [Limit] TPM Hit ({current_tpm + estimated_tokens}/{self.tpm_limit}). Waiting...")
+                    if self.token_timestamps:
+                        wait_secs = min(wait_secs, 60 - (now - self.token_timestamps[0][0]))
+                
+                # wait() releases the lock so other threads are not blocked while we sleep
+                self.cond.wait(timeout=max(0, wait_secs))
+            
+            # Record usage
+            now = time.monotonic()
+            self.request_timestamps.append(now)
+            self.token_timestamps.append((now, estimated_tokens))
+            self._token_sum += estimated_tokens
+            self.cond.notify_all()
+
+# --- RETRIES ---
+
+def backoff_delay(attempt, base=2.0, cap=30.0):
+    """
+    Seconds to wait before retry number attempt + 1: exponential, with full
+    jitter so workers that failed together don't all retry together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# --- THREAD POOL ---
+
+def run_in_pool(func, items, max_workers, label=str):
+    """
+    Runs func(item) for every item on a thread pool and reports each one as it
+    finishes. A failing item is logged without stopping the others, and Ctrl-C
+    cancels the items that have not started yet.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+        try:
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"[{label(futures[future])}] Error: {e}")
+                print(f"Progress: {done}/{len(futures)} done.")
+        except KeyboardInterrupt:
+            print("Interrupted. Cancelling queued chapters, waiting for the ones in flight...")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+# --- SLEEP PREVENTION ---
+
+# SetThreadExecutionState only exists on Windows; elsewhere the kernel32
+# handle stays None and both helpers do nothing
+if sys.platform == "win32":
+    import ctypes
+    KERNEL32 = ctypes.windll.kernel32
+else:
+    KERNEL32 = None
+ES_CONTINUOUS = 0x80000000
+ES_SYSTEM_REQUIRED = 0x00000001
+
+def prevent_sleep():
+    """Keeps Windows from sleeping during a long translation run."""
+    if KERNEL32:
+        print("Preventing system sleep...")
+        KERNEL32.SetThreadExecutionState(ES_CONTINUOUS | ES_SYSTEM_REQUIRED)
+
+def allow_sleep():
+    """Lets Windows sleep again."""
+    if KERNEL32:
+        print("Allowing system sleep...")
+        KERNEL32.SetThreadExecutionState(ES_CONTINUOUS)
@@ -1,12 +1,18 @@
 import os
-import json
 import time
 import argparse
-import ctypes
+import importlib.util
 import threading
 import generate_site
+from translator_core import (
+    run_in_pool, json_loads, json_dumps, load_glossary, save_glossary,
+    build_glossary_index, filter_glossary, merge_new_terms,
+    split_nonblank_lines, check_refusal, check_hallucination, validate_translation, validate_content,
+    END_MARKER_RE, END_MARKER_TAIL_BYTES, VALIDATION_CACHE_FILE, load_validation_cache, save_validation_cache,
+    numbered_chapters, make_batches, backoff_delay, prevent_sleep, allow_sleep,
+)
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
 
 # Load environment variables
 load_dotenv()
@@ -27,175 +33,192 @@ DEFAULT_RAW_DIR = "raw_chapters"
 DEFAULT_TRANSLATED_DIR = "translated_chapters"
 DEFAULT_GLOSSARY_FILE = "glossary.json"
 
+# The client already keeps its connections alive across requests; with the
+# optional h2 package installed, concurrent workers also share one HTTP/2
+# connection instead of each opening its own TLS connection.
 client = OpenAI(
     api_key=API_KEY,
-    base_url=BASE_URL
+    base_url=BASE_URL,
+    http_client=DefaultHttpxClient(http2=importlib.util.find_spec("h2") is not None)
 )
 
 # Thread synchronization
 glossary_lock = threading.Lock()
 
-# Windows Sleep Prevention
-ES_CONTINUOUS = 0x80000000
-ES_SYSTEM_REQUIRED = 0x00000001
-
-def prevent_sleep():
-    try:
-        ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS | ES_SYSTEM_REQUIRED)
-    except AttributeError:
-        pass
-
-def allow_sleep():
-    try:
-        ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS)
-    except AttributeError:
-        pass
-
 # --- VALIDATION LOGIC ---
 
-def check_hallucination(text):
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    if len(lines) < 10: return False
-    for i in range(len(lines) - 5):
-        chunk = lines[i:i+5]
-        if i + 10 <= len(lines):
-            next_chunk = lines[i+5:i+10]
-            if chunk == next_chunk: return True
-    return False
-
-def check_refusal(text):
-    refusal_keywords = ["I cannot translate", "I can't translate", "content policy", "safety guidelines"]
-    lower_text = text.lower()
-    return any(k in lower_text for k in refusal_keywords)
-
-def validate_translation(filepath, source_text=None):
+def validate_response_text(content, filepath, source_text=None):
+    """
+    validate_text for a freshly parsed response, except that a missing end
+    marker is appended instead of failing the chapter. The JSON parsed, so the
+    response wasn't cut off; if every other check passes the model just dropped
+    the marker, and repairing it saves a paid retry against the daily cap.
+    Returns the (possibly repaired) text, or None if it is invalid.
+    """
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-            if not content.strip():
-                print(f"❌ Empty content: {filepath}")
-                return False
-            
-            if check_refusal(content):
-                print(f"❌ Refusal detected: {filepath}")
-                return False
-
-            if check_hallucination(content):
-                print(f"❌ Hallucination detected: {filepath}")
-                return False
-
-            if source_text:
-                if len(source_text) > 0:
-                    ratio = len(content) / len(source_text)
-                    if ratio < 0.6: 
-                        print(f"❌ Text too short ({ratio:.2f}x). Likely summary.")
-                        return False
-                
-                source_lines = len([x for x in source_text.split('\n') if x.strip()])
-                trans_lines = len([x for x in content.split('\n') if x.strip()])
-                
-                # Strict check for SambaNova because it is fast and might skip
-                if source_lines > 20 and trans_lines < (source_lines * 0.5):
-                    print(f"❌ Paragraph mismatch (Source: {source_lines}, Trans: {trans_lines}). Content skipped.")
-                    return False
-
-            if "<<END_OF_CHAPTER>>" in content:
-                return True
-            
-            print(f"❌ Missing <<END_OF_CHAPTER>> marker: {filepath}")
-            return False
+        if not validate_content(content, filepath, source_text):
+            return None
+        if not END_MARKER_RE.search(content[-END_MARKER_TAIL_BYTES:].encode('utf-8')):
+            print(f"🔧 Appended missing <<END_OF_CHAPTER>> marker: {filepath}")
+            content += "\n\n<<END_OF_CHAPTER>>"
+        return content
 
     except Exception as e:
         print(f"Error validating {filepath}: {e}")
-        return False
+        return None
 
 # --- UTILS ---
 
-def load_glossary(glossary_path):
-    if os.path.exists(glossary_path):
-        with open(glossary_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_glossary(glossary, glossary_path):
-    with open(glossary_path, "w", encoding="utf-8") as f:
-        json.dump(glossary, f, ensure_ascii=False, indent=4)
-
-def filter_glossary(text, full_glossary):
-    relevant = {}
-    for term, translation in full_glossary.items():
-        if term in text:
-            relevant[term] = translation
-    return relevant
-
 def estimate_tokens(text):
-    # CJK char approx 1.3 tokens on Llama/DeepSeek tokenizers
+    # Budget for the whole round trip per source character: roughly 0.6
+    # input tokens per CJK char on DeepSeek plus the English output, which
+    # runs longer than the source. Only a reservation; the real usage
+    # replaces it once SambaNova reports it.
     return int(len(text) * 1.3)
 
 # --- GLOBAL COUNTERS ---
 # Since SambaNova has a hard daily limit, we track this session's usage
 session_requests = 0
 session_tokens = 0
+# Chapters run on a thread pool, so the check and the increment happen under
+# one lock; session_stop tells every worker to stop once a limit is hit
+session_lock = threading.Lock()
+session_stop = threading.Event()
 
-def check_session_limits(estimated_tokens):
+def reserve_session_request(estimated_tokens):
+    """
+    Counts one request and its estimated tokens against the daily limits.
+    Returns False, and stops the session for every worker, once a limit is reached.
+    """
     global session_requests, session_tokens
-    if session_requests >= DAILY_REQUEST_LIMIT:
-        print(f"\n⚠️  DAILY LIMIT REACHED (Requests: {session_requests}). Stopping script.")
-        return False
-    if session_tokens + estimated_tokens >= DAILY_TOKEN_LIMIT:
-        print(f"\n⚠️  DAILY TOKEN LIMIT REACHED (Tokens: {session_tokens}). Stopping script.")
-        return False
-    return True
+    with session_lock:
+        if session_stop.is_set():
+            return False
+        if session_requests >= DAILY_REQUEST_LIMIT:
+            print(f"\n⚠️  DAILY LIMIT REACHED (Requests: {session_requests}). Stopping script.")
+            session_stop.set()
+            return False
+        if session_tokens + estimated_tokens >= DAILY_TOKEN_LIMIT:
+            print(f"\n⚠️  DAILY TOKEN LIMIT REACHED (Tokens: {session_tokens}). Stopping script.")
+            session_stop.set()
+            return False
+        session_requests += 1
+        session_tokens += estimated_tokens
+        return True
 
 # --- MAIN PROCESS ---
 
-def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossary_path):
-    global session_requests, session_tokens
-    
-    raw_path = os.path.join(raw_dir, chapter_filename)
-    translated_path = os.path.join(translated_dir, chapter_filename)
-    
-    with open(raw_path, "r", encoding="utf-8") as f:
-        text = f.read()
+STREAM_CHECK_EVERY = 50  # Stream chunks between refusal/loop checks
+STREAM_CHECK_CHUNKS = 1000  # How many recent chunks the checks look at
 
-    current_glossary = filter_glossary(text, glossary)
-    
-    # Approx tokens
-    total_est = estimate_tokens(text) + 2000 
-    
-    # Check limits before we start
-    if not check_session_limits(total_est):
-        return "STOP"
-    
-    system_prompt = f"""
+def stream_completion(reserved_tokens, **kwargs):
+    """
+    Streams a chat completion and returns (content, aborted). aborted is None
+    for a complete response, or "refusal" / "loop" when the output turned into
+    one and the stream was abandoned early, in which case content is None.
+    The reserved_tokens estimate is swapped for the real usage when
+    SambaNova reports it (it doesn't always, and never for an aborted stream).
+    """
+    global session_tokens
+    stream = client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **kwargs
+    )
+    parts = []
+    try:
+        for n, chunk in enumerate(stream, 1):
+            if chunk.usage:
+                with session_lock:
+                    session_tokens += chunk.usage.total_tokens - reserved_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            if n % STREAM_CHECK_EVERY == 0:
+                # The text is still JSON-escaped, so unescape newlines to get lines back
+                tail = "".join(parts[-STREAM_CHECK_CHUNKS:]).replace("\\n", "\n")
+                if check_refusal(tail, edges_only=True):
+                    return None, "refusal"
+                if check_hallucination(split_nonblank_lines(tail)):
+                    return None, "loop"
+    finally:
+        stream.close()
+    return "".join(parts), None
+
+SYSTEM_PROMPT_HEAD = """
     You are a professional novel translator (Chinese to English).
     
     CRITICAL INSTRUCTIONS:
     1. **NO SUMMARIZATION:** Translate every single sentence. Do not skip scenes.
     2. **FORMAT:** Output strict Markdown. Use double newlines for paragraphs.
     3. **GLOSSARY:** Strictly follow these terms:
-    {json.dumps(current_glossary, ensure_ascii=False)}
+    """
+SYSTEM_PROMPT_TAIL = """
     
     4. **OUTPUT FORMAT:** Return ONLY a valid JSON object.
     Structure:
-    {{
+    {
         "translated_text": "The full markdown translation... <<END_OF_CHAPTER>>",
-        "new_terms": [{{"original_term": "Name", "english_translation": "Name"}}]
-    }}
+        "new_terms": [{"original_term": "Name", "english_translation": "Name"}]
+    }
     
     Append <<END_OF_CHAPTER>> at the very end of the translated text string.
     """
 
+# Batch mode (--batch-size > 1): several short chapters share one request,
+# since the daily request cap binds long before the token cap.
+BATCH_MAX_CHARS = 8000  # The combined translation has to fit in one completion
+
+BATCH_SYSTEM_PROMPT_TAIL = """
+    
+    4. **OUTPUT FORMAT:** Return ONLY a valid JSON object.
+    Each chapter is wrapped in "=== CHAPTER <id> START ===" and "=== CHAPTER <id> END ===".
+    Return one entry per chapter, in the same order:
+    {
+        "chapters": [
+            {
+                "chapter_id": "<id>",
+                "translated_text": "The full markdown translation... <<END_OF_CHAPTER>>",
+                "new_terms": [{"original_term": "Name", "english_translation": "Name"}]
+            }
+        ]
+    }
+    
+    Append <<END_OF_CHAPTER>> at the very end of every translated_text string.
+    """
+
+def process_chapter(chapter_filename, glossary, glossary_index, raw_dir, translated_dir, glossary_path):
+    # Another worker already hit a limit; leave the queued chapters alone
+    if session_stop.is_set():
+        return "STOP"
+    
+    raw_path = os.path.join(raw_dir, chapter_filename)
+    translated_path = os.path.join(translated_dir, chapter_filename)
+    
+    with open(raw_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    # (under the lock, since other workers may be adding terms concurrently)
+    with glossary_lock:
+        current_glossary = filter_glossary(text, glossary, glossary_index)
+    
+    # Approx tokens
+    total_est = estimate_tokens(text) + 2000 
+    
+    system_prompt = SYSTEM_PROMPT_HEAD + json_dumps(current_glossary) + SYSTEM_PROMPT_TAIL
+
     user_prompt = f"Translate:\n\n{text}"
 
     max_retries = 3
     
     for attempt in range(max_retries):
+        # Check limits before every request, retries included
+        if not reserve_session_request(total_est):
+            return "STOP"
         try:
             print(f"[{chapter_filename}] Sending to SambaNova ({MODEL_NAME})...")
             
-            response = client.chat.completions.create(
+            # Streamed, so a refusal or a loop is cut short instead of
+            # generating the whole chapter first
+            response_content, aborted = stream_completion(
+                total_est,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -204,49 +227,120 @@ def process_chapter(chapter_filename, glossary, raw_dir, translated_dir, glossar
                 response_format={"type": "json_object"}, 
                 temperature=0.7
             )
-            
-            # Increment Counters
-            session_requests += 1
-            # SambaNova doesn't always return usage in the same format, so we estimate or read from response
-            if response.usage:
-                session_tokens += response.usage.total_tokens
-            else:
-                session_tokens += total_est
-
-            response_content = response.choices[0].message.content
-            result = json.loads(response_content)
+            if aborted == "refusal":
+                # Same as a refusal caught after the fact: the prompt will just be refused again
+                print(f"[{chapter_filename}] Refused by the model mid-stream. Not retrying.")
+                return "FAILED"
+            if aborted:
+                print(f"[{chapter_filename}] Loop detected mid-stream, aborted (Attempt {attempt+1}).")
+                continue
+
+            result = json_loads(response_content)
             
             final_text = result.get("translated_text", "")
             new_terms_list = result.get("new_terms", [])
+            checked_text = validate_response_text(final_text, translated_path, source_text=text)
             
+            # Save even a failed attempt, so --fix-only can find it later
             with open(translated_path, "w", encoding="utf-8") as f:
-                f.write(final_text)
+                f.write(checked_text or final_text)
             
-            if validate_translation(translated_path, source_text=text):
-                if new_terms_list:
-                    with glossary_lock:
-                        unique_terms = {t['original_term']: t['english_translation'] for t in new_terms_list}
-                        if unique_terms:
-                            print(f"[{chapter_filename}] Found {len(unique_terms)} new terms.")
-                            for k, v in unique_terms.items():
-                                glossary[k] = v
-                            save_glossary(glossary, glossary_path)
+            if checked_text:
+                merge_new_terms(chapter_filename, new_terms_list, glossary, glossary_index, glossary_path, glossary_lock)
                 print(f"[{chapter_filename}] ✅ DONE. (Session Req: {session_requests}/{DAILY_REQUEST_LIMIT})")
                 return "SUCCESS"
+            elif check_refusal(final_text):
+                # The same prompt will just be refused again
+                print(f"[{chapter_filename}] Refused by the model. Not retrying.")
+                return "FAILED"
             else:
                 print(f"[{chapter_filename}] Validation failed (Attempt {attempt+1}).")
-                time.sleep(2)
                 
         except Exception as e:
             print(f"[{chapter_filename}] Error: {e}")
             if "429" in str(e):
                 print("🚨 429 Rate Limit Hit. This likely means your Daily Quota is fully used.")
+                session_stop.set()
                 return "STOP"
-            time.sleep(5)
+            # A bad response is retried right away; only errors back off
+            if attempt + 1 < max_retries:
+                time.sleep(backoff_delay(attempt))
 
     print(f"[{chapter_filename}] ❌ FAILED after retries.")
     return "FAILED"
 
+def process_chapter_batch(chapter_files, glossary, glossary_index, raw_dir, translated_dir, glossary_path):
+    """
+    Translates several chapters in one request. Any chapter that is missing
+    from the response or fails validation falls back to process_chapter.
+    """
+    if len(chapter_files) == 1 or session_stop.is_set():
+        for chapter_filename in chapter_files:
+            process_chapter(chapter_filename, glossary, glossary_index, raw_dir, translated_dir, glossary_path)
+        return
+
+    texts = {}
+    for chapter_filename in chapter_files:
+        with open(os.path.join(raw_dir, chapter_filename), "r", encoding="utf-8") as f:
+            texts[chapter_filename] = f.read()
+
+    with glossary_lock:
+        current_glossary = filter_glossary("\n".join(texts.values()), glossary, glossary_index)
+
+    system_prompt = SYSTEM_PROMPT_HEAD + json_dumps(current_glossary) + BATCH_SYSTEM_PROMPT_TAIL
+    user_prompt = "Translate:\n\n" + "".join(
+        f"=== CHAPTER {name} START ===\n{text}\n=== CHAPTER {name} END ===\n"
+        for name, text in texts.items()
+    )
+    total_est = estimate_tokens(user_prompt) + 2000
+    label = f"{chapter_files[0]}..{chapter_files[-1]}"
+
+    if not reserve_session_request(total_est):
+        return
+
+    done = set()
+    try:
+        print(f"[{label}] Sending {len(chapter_files)} chapters to SambaNova ({MODEL_NAME}) in one request...")
+        response_content, aborted = stream_completion(
+            total_est,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            model=MODEL_NAME,
+            response_format={"type": "json_object"}, 
+            temperature=0.7
+        )
+        if aborted:
+            raise ValueError(f"{aborted} detected mid-stream, aborted")
+
+        result = json_loads(response_content)
+        items = {item.get("chapter_id"): item for item in result.get("chapters", [])}
+
+        for chapter_filename, text in texts.items():
+            item = items.get(chapter_filename)
+            if not item or not item.get("translated_text"):
+                continue
+            translated_path = os.path.join(translated_dir, chapter_filename)
+            checked_text = validate_response_text(item["translated_text"], translated_path, source_text=text)
+            with open(translated_path, "w", encoding="utf-8") as f:
+                f.write(checked_text or item["translated_text"])
+            if checked_text:
+                merge_new_terms(chapter_filename, item.get("new_terms", []), glossary, glossary_index, glossary_path, glossary_lock)
+                print(f"[{chapter_filename}] ✅ DONE. (Session Req: {session_requests}/{DAILY_REQUEST_LIMIT})")
+                done.add(chapter_filename)
+    except Exception as e:
+        print(f"[{label}] Batch error: {e}")
+        if "429" in str(e):
+            print("🚨 429 Rate Limit Hit. This likely means your Daily Quota is fully used.")
+            session_stop.set()
+            return
+
+    for chapter_filename in chapter_files:
+        if chapter_filename not in done:
+            print(f"[{chapter_filename}] Not translated by the batch, retrying on its own...")
+            process_chapter(chapter_filename, glossary, glossary_index, raw_dir, translated_dir, glossary_path)
+
 def process_book(book_dir, args):
     print(f"\n--- Processing Book: {book_dir} ---")
     raw_dir = os.path.join(book_dir, DEFAULT_RAW_DIR)
@@ -255,28 +349,47 @@ def process_book(book_dir, args):
     
     os.makedirs(translated_dir, exist_ok=True)
     glossary = load_glossary(glossary_path)
+    if os.path.exists(glossary_path + "l"):
+        save_glossary(glossary, glossary_path)  # Fold in terms left by an interrupted run
+    glossary_index = build_glossary_index(glossary)
 
     if not os.path.exists(raw_dir): return
 
-    chapters = sorted([f for f in os.listdir(raw_dir) if f.endswith(".txt")])
+    # One directory walk each instead of an exists() per chapter
+    with os.scandir(raw_dir) as it:
+        raw_entries = numbered_chapters(it)
+    with os.scandir(translated_dir) as it:
+        translated_entries = {e.name: e for e in it if e.name.endswith(".txt")}
     chapters_to_translate = []
 
-    for chapter_file in chapters:
-        try:
-            chapter_num = int(chapter_file.split("_")[1].split(".")[0])
-        except: continue
+    # Validation results keyed on the (mtime, size) of both files, so an
+    # audit re-run does not re-read unchanged chapters
+    validation_cache_path = os.path.join(translated_dir, VALIDATION_CACHE_FILE)
+    # --reaudit drops cached results, e.g. after the validation rules change
+    validation_cache = {} if args.reaudit else load_validation_cache(validation_cache_path)
+
+    for chapter_num, raw_entry in raw_entries:
+        chapter_file = raw_entry.name
         
         if args.chapters and chapter_num not in args.chapters: continue
 
-        translated_path = os.path.join(translated_dir, chapter_file)
-        
-        if os.path.exists(translated_path):
+        translated_entry = translated_entries.get(chapter_file)
+        if translated_entry is not None:
             if not args.force:
                 if args.audit or args.fix_only:
                     try:
-                        with open(os.path.join(raw_dir, chapter_file), "r", encoding="utf-8") as f:
-                            src = f.read()
-                        if validate_translation(translated_path, source_text=src):
+                        trans_st = translated_entry.stat()
+                        raw_st = raw_entry.stat()
+                        key = [trans_st.st_mtime_ns, trans_st.st_size, raw_st.st_mtime_ns, raw_st.st_size]
+                        cached = validation_cache.get(chapter_file)
+                        if cached and cached["key"] == key:
+                            is_valid = cached["ok"]
+                        else:
+                            with open(raw_entry.path, "r", encoding="utf-8") as f:
+                                src = f.read()
+                            is_valid = validate_translation(translated_entry.path, source_text=src)
+                            validation_cache[chapter_file] = {"key": key, "ok": is_valid}
+                        if is_valid:
                             continue
                     except: pass 
                 else:
@@ -284,17 +397,34 @@ def process_book(book_dir, args):
 
         chapters_to_translate.append(chapter_file)
 
+    save_validation_cache(validation_cache, validation_cache_path)
+
     if args.limit and not args.chapters:
         chapters_to_translate = chapters_to_translate[:args.limit]
 
     print(f"Queue size: {len(chapters_to_translate)}")
     if args.audit: return
 
-    for chapter_file in chapters_to_translate:
-        status = process_chapter(chapter_file, glossary, raw_dir, translated_dir, glossary_path)
-        if status == "STOP":
-            print("🛑 Stopping translation session due to limits.")
-            break
+    # Requests are network-bound, so a few threads overlap them; glossary_lock
+    # and session_lock guard the shared state
+    workers = max(1, min(8, args.workers))
+    if args.batch_size > 1:
+        run_in_pool(
+            lambda batch: process_chapter_batch(batch, glossary, glossary_index, raw_dir, translated_dir, glossary_path),
+            make_batches(raw_dir, chapters_to_translate, args.batch_size, BATCH_MAX_CHARS), workers,
+            label=lambda batch: f"{batch[0]}..{batch[-1]}"
+        )
+    else:
+        run_in_pool(
+            lambda chapter_file: process_chapter(chapter_file, glossary, glossary_index, raw_dir, translated_dir, glossary_path),
+            chapters_to_translate, workers
+        )
+    if session_stop.is_set():
+        print("🛑 Stopping translation session due to limits.")
+
+    # Compact the journal back into the pretty JSON
+    if os.path.exists(glossary_path + "l"):
+        save_glossary(glossary, glossary_path)
 
     try:
         generate_site.generate_site(source_dir=translated_dir, output_dir=os.path.join(book_dir, "docs"))
@@ -307,8 +437,11 @@ def main():
     parser.add_argument("--force", action="store_true")
     parser.add_argument("--audit", action="store_true")
     parser.add_argument("--fix-only", action="store_true")
+    parser.add_argument("--reaudit", action="store_true")
     parser.add_argument("--book_dir", type=str)
     parser.add_argument("--library_dir", type=str)
+    parser.add_argument("--workers", type=int, default=4, help="Number of chapters to translate concurrently (max 8).")
+    parser.add_argument("--batch-size", type=int, default=1, help="Translate up to this many short chapters per request (default 1: no batching).")
     args = parser.parse_args()
 
     prevent_sleep()